@@ -10,3 +10,7 @@ Modified for Python 3 compatibility
 """
 
 __version__ = '2.0.0'
+
+from .scanner import Scanner, Baseline, ScanScore, default_tests
+
+__all__ = ['Scanner', 'Baseline', 'ScanScore', 'default_tests']
@@ -0,0 +1,316 @@
+"""Vectorised alarm-mode statistics and combined scores.
+
+The values of a test are packed into one float array (a NumPy array when
+NumPy is installed, a list otherwise), so the centre and spread, the
+flagging and the multi-test combined scores each take a few passes over
+contiguous memory instead of walks over one dict per file.
+
+The mean and standard deviation are inflated by the very outliers alarm
+mode looks for, so robust statistics can be selected instead:
+
+- stddev: distance from the mean, in standard deviations
+- mad: distance from the median, in median absolute deviations scaled to
+  match the standard deviation of normally distributed values (the mean
+  absolute deviation when over half the values equal the median, as is
+  common for signature counts)
+- percentile: values beyond the given percentile on the suspicious side,
+  scored by their percentile rank
+"""
+
+import math
+from bisect import bisect_left, bisect_right
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ALARM_STATS = ("stddev", "mad", "percentile")
+COMBINE_MODES = ("rank", "score")
+MAD_SCALE = 1.4826  # MAD of normal data times this is its standard deviation
+MEANAD_SCALE = 1.2533  # Same for the mean absolute deviation, used when the MAD is 0
+STAT_UNITS = {"stddev": "sd", "mad": "mad", "percentile": "pct"}
+
+def pack(values):
+    """Return values (a sequence of floats, or None for missing) as a float array.
+
+    Missing values become NaN. array('d') stores are wrapped without a copy.
+    """
+    if np is None:
+        return [math.nan if value is None else value for value in values]
+    if isinstance(values, np.ndarray):
+        return values
+    try:
+        return np.frombuffer(values, dtype=np.float64)
+    except TypeError:
+        return np.array([math.nan if value is None else value for value in values],
+                        dtype=np.float64)
+
+def packed_results(results):
+    """Return (values, result_at, sample) for a test's results.
+
+    values packs the non-missing values and result_at(i) builds the result
+    dict of values[i]. sample holds the values to estimate the centre and
+    spread from: values itself, or a uniform sample of every value when
+    only the top results are kept.
+    """
+    if isinstance(results, list):
+        kept = [result for result in results if result["value"] is not None]
+        values = pack([result["value"] for result in kept])
+        return values, kept.__getitem__, values
+    return results.packed()
+
+def quantile(ordered, fraction):
+    """Linearly interpolated quantile of sorted values, as numpy.quantile."""
+    if len(ordered) == 0:
+        return 0.0
+    position = fraction * (len(ordered) - 1)
+    low = math.floor(position)
+    high = min(low + 1, len(ordered) - 1)
+    return float(ordered[low] + (ordered[high] - ordered[low]) * (position - low))
+
+def centre_spread(sample, stat, stats=None):
+    """Return the (centre, spread) of sample for the stddev or mad statistic.
+
+    For stddev, RunningStats given as stats are used instead of sample, as
+    they cover every value even when only some are kept.
+    """
+    if stat == "stddev":
+        if stats is not None:
+            return stats.mean, stats.stddev
+        if len(sample) == 0:
+            return 0.0, 0.0
+        if np is not None:
+            return float(sample.mean()), float(sample.std())
+        mean = math.fsum(sample) / len(sample)
+        return mean, math.sqrt(math.fsum((value - mean) ** 2 for value in sample) / len(sample))
+    if np is not None:
+        median = quantile(np.sort(sample), 0.5)
+        distances = np.sort(np.abs(sample - median))
+        mean_distance = float(distances.mean()) if len(distances) else 0.0
+    else:
+        median = quantile(sorted(sample), 0.5)
+        distances = sorted(abs(value - median) for value in sample)
+        mean_distance = math.fsum(distances) / len(distances) if distances else 0.0
+    mad = quantile(distances, 0.5)
+    return median, MAD_SCALE * mad if mad > 0 else MEANAD_SCALE * mean_distance
+
+def deviation(value, centre, spread, high_is_bad):
+    """Return how many spreads value lies on the suspicious side of centre."""
+    distance = value - centre if high_is_bad else centre - value
+    if spread > 0:
+        return distance / spread
+    return math.copysign(math.inf, distance) if distance else 0.0
+
+def deviations(values, centre, spread, high_is_bad):
+    """Return how many spreads each value lies on the suspicious side of centre.
+
+    Values on the other side are negative; with no spread every value away
+    from the centre is infinitely far.
+    """
+    if np is not None:
+        distance = values - centre if high_is_bad else centre - values
+        if spread > 0:
+            return distance / spread
+        return np.where(distance > 0, math.inf, np.where(distance < 0, -math.inf, 0.0))
+    return [deviation(value, centre, spread, high_is_bad) for value in values]
+
+def percentile_rank(value, ordered, high_is_bad):
+    """Return the percentage of the sorted values ordered that value is more suspicious than."""
+    if not ordered:
+        return 0.0
+    if high_is_bad:
+        return 100.0 * bisect_left(ordered, value) / len(ordered)
+    return 100.0 * (len(ordered) - bisect_right(ordered, value)) / len(ordered)
+
+def percentile_ranks(values, sample, high_is_bad):
+    """Return the percentage of sample each value is more suspicious than."""
+    if len(sample) == 0:
+        return values * 0.0 if np is not None else [0.0] * len(values)
+    count = len(sample)
+    if np is not None:
+        ordered = np.sort(sample)
+        if high_is_bad:
+            return 100.0 * np.searchsorted(ordered, values, "left") / count
+        return 100.0 * (count - np.searchsorted(ordered, values, "right")) / count
+    ordered = sorted(sample)
+    return [percentile_rank(value, ordered, high_is_bad) for value in values]
+
+def scores(values, sample, stat, high_is_bad, stats=None):
+    """Return the suspiciousness score of each value under stat."""
+    if stat == "percentile":
+        return percentile_ranks(values, sample, high_is_bad)
+    centre, spread = centre_spread(sample, stat, stats)
+    return deviations(values, centre, spread, high_is_bad)
+
+def beyond_percentile(values, sample, threshold, high_is_bad):
+    """Return a mask of the values beyond the threshold-th percentile of sample."""
+    cutoff = quantile(np.sort(sample) if np is not None else sorted(sample),
+                      threshold / 100.0 if high_is_bad else 1.0 - threshold / 100.0)
+    if np is not None:
+        return values > cutoff if high_is_bad else values < cutoff
+    return [(value > cutoff) if high_is_bad else (value < cutoff) for value in values]
+
+def flag_alarm(test, threshold, stat="stddev", reference=None):
+    """Return the result dicts of test flagged under stat, least suspicious first.
+
+    Each gets its score as "percentage": standard or median absolute
+    deviations from the centre, or the percentile rank. With the stddev
+    and mad statistics, values more than threshold spreads from the
+    centre on the suspicious side are flagged; with percentile, values
+    beyond the threshold-th percentile.
+
+    The centre and spread, or the values ranked against for percentile,
+    are those of the test's own values unless given as reference (an
+    entry of a scanner.Baseline), e.g. to check a few changed files
+    against the statistics of a previous full scan.
+    """
+    values, result_at, sample = packed_results(test.results)
+    if stat == "percentile":
+        if reference is not None:
+            sample = pack(reference)
+        # Only the flagged values need their percentile rank
+        mask = beyond_percentile(values, sample, threshold, test.high_is_bad)
+        if np is not None:
+            indexes = np.flatnonzero(mask)
+            score = percentile_ranks(values[indexes], sample, test.high_is_bad)
+        else:
+            indexes = [idx for idx, hit in enumerate(mask) if hit]
+            score = percentile_ranks([values[idx] for idx in indexes], sample, test.high_is_bad)
+    else:
+        stats = None if isinstance(test.results, list) else test.results.stats
+        score = deviations(values, *(reference or centre_spread(sample, stat, stats)),
+                           test.high_is_bad)
+        if np is not None:
+            indexes = np.flatnonzero(score > threshold)
+            score = score[indexes]
+        else:
+            indexes = [idx for idx, value in enumerate(score) if value > threshold]
+            score = [score[idx] for idx in indexes]
+
+    flags = []
+    for idx, value in sorted(zip(indexes, score), key=lambda item: item[1]):
+        result = result_at(int(idx))
+        result["percentage"] = float(value)
+        flags.append(result)
+    return flags
+
+def result_column(results):
+    """Return (filenames, values) of a test's results in the order recorded.
+
+    Missing values are NaN.
+    """
+    if isinstance(results, list):
+        return ([result["filename"] for result in results],
+                pack([result["value"] for result in results]))
+    return results.column()
+
+def align(tests):
+    """Return (filenames, one value array per test) aligned on filenames.
+
+    Tests normally hold the same files in the same order, which needs no
+    lookups; otherwise (merged partials, --cascade gaps in compact stores)
+    the files are matched by name, with NaN where a test has no value.
+    """
+    columns = [result_column(test.results) for test in tests]
+    names = columns[0][0]
+    if all(column_names == names for column_names, _ in columns[1:]):
+        return names, [values for _, values in columns]
+
+    index = {}
+    for column_names, _ in columns:
+        for name in column_names:
+            index.setdefault(name, len(index))
+    aligned = []
+    for column_names, values in columns:
+        full = pack([None] * len(index))
+        for name, value in zip(column_names, values):
+            full[index[name]] = value
+        aligned.append(full)
+    return list(index), aligned
+
+def ranks(values, high_is_bad):
+    """Return the rank of each value, as Test.sort assigns them.
+
+    Missing values (files the cascade skipped, tests that timed out) rank
+    after every present one, so they never lift a file in the combined
+    ranking.
+    """
+    if np is not None:
+        valid = np.flatnonzero(~np.isnan(values))
+        order = valid[np.argsort(-values[valid] if high_is_bad else values[valid])]
+        ordered = values[order]
+        # Equal values share the rank of the first of them
+        starts = np.ones(len(ordered), dtype=bool)
+        starts[1:] = ordered[1:] != ordered[:-1]
+        result = np.full(len(values), len(ordered) + 1, dtype=np.int64)
+        result[order] = np.maximum.accumulate(
+            np.where(starts, np.arange(1, len(ordered) + 1), 0)
+        ) if len(ordered) else 0
+        return result
+    ordered = sorted(value for value in values if not math.isnan(value))
+    missing = len(ordered) + 1
+    if high_is_bad:
+        return [missing if math.isnan(value) else 1 + len(ordered) - bisect_right(ordered, value)
+                for value in values]
+    return [missing if math.isnan(value) else 1 + bisect_left(ordered, value)
+            for value in values]
+
+def combined_scores(tests, stat="stddev"):
+    """Return the sum over tests of each file's score under stat (missing counts 0)."""
+    totals = None
+    names, columns = align(tests)
+    for test, values in zip(tests, columns):
+        stats = None if isinstance(test.results, list) else test.results.stats
+        if np is not None:
+            valid = ~np.isnan(values)
+            score = np.zeros(len(values))
+            score[valid] = scores(values[valid], values[valid], stat, test.high_is_bad, stats)
+            totals = score if totals is None else totals + score
+            continue
+        present = [value for value in values if not math.isnan(value)]
+        score = iter(scores(present, present, stat, test.high_is_bad, stats))
+        score = [0.0 if math.isnan(value) else next(score) for value in values]
+        totals = score if totals is None else [a + b for a, b in zip(totals, score)]
+    return names, totals
+
+def smallest(keys, count):
+    """Return the indexes of the count smallest keys in order, ties by index."""
+    if len(keys) > count:
+        # Only the keys up to the count-th smallest need sorting
+        candidates = np.flatnonzero(keys <= np.partition(keys, count - 1)[count - 1])
+    else:
+        candidates = np.arange(len(keys))
+    return candidates[np.argsort(keys[candidates], kind="stable")][:count].tolist()
+
+def combined_ranking(tests, mode="rank", stat="stddev", count=10):
+    """Return the count most suspicious (filename, combined value) over all tests.
+
+    mode "rank" sums each file's rank in every test, lowest first, ties
+    going to the better ranked file in the first test; "score" sums each
+    file's score under stat, highest first.
+    """
+    if not tests:
+        return []
+    if mode == "score":
+        names, totals = combined_scores(tests, stat)
+        if np is not None:
+            order = smallest(-totals, count)
+        else:
+            order = sorted(range(len(names)), key=lambda idx: -totals[idx])[:count]
+        return [(names[idx], float(totals[idx])) for idx in order]
+
+    names, columns = align(tests)
+    first = ranks(columns[0], tests[0].high_is_bad)
+    totals = first
+    for test, values in zip(tests[1:], columns[1:]):
+        column_ranks = ranks(values, test.high_is_bad)
+        totals = (totals + column_ranks if np is not None
+                  else [a + b for a, b in zip(totals, column_ranks)])
+    if np is not None:
+        # One key sorting by total, then by the rank in the first test
+        order = smallest(totals * (len(names) + 2) + first, count)
+    else:
+        order = sorted(range(len(names)),
+                       key=lambda idx: (totals[idx], first[idx]))[:count]
+    return [(names[idx], int(totals[idx])) for idx in order]
@@ -0,0 +1,122 @@
+"""Scanning inside archives.
+
+With --archives, zip, tar (plain, gzip, bzip2 or xz compressed) and single
+gzip files are not analysed as opaque bytes: their members are streamed
+out one at a time, filtered by the filename regex, and each one goes
+through the tests like a file on disk, reported as
+`archive.tar.gz!/path/in/archive.php`. Nothing is extracted to disk and
+nested archives are not opened. Every archive is capped in decompressed
+bytes and members, so a zip bomb costs at most that much memory and time.
+"""
+
+import gzip
+import lzma
+import posixpath
+import re
+import tarfile
+import zipfile
+import zlib
+
+SEPARATOR = "!/"  # Between an archive's path and a member's name
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+ARCHIVE_NAME = r"(?i:\.(?:zip|gz|tar|tgz|tbz2|txz|tar\.bz2|tar\.xz)$)"
+DEFAULT_MAX_BYTES = 64 << 20  # Decompressed bytes read per archive
+DEFAULT_MAX_MEMBERS = 10000  # Members looked at per archive
+ARCHIVE_ERRORS = (OSError, EOFError, RuntimeError, ValueError, NotImplementedError,
+                  zipfile.BadZipFile, tarfile.TarError, lzma.LZMAError, zlib.error)
+
+def is_archive(filepath):
+    """Whether filepath is named like an archive neopi can open."""
+    return re.search(ARCHIVE_NAME, filepath) is not None
+
+def archive_pattern(pattern):
+    """Return the filename regex pattern extended to also match archives."""
+    return re.compile(f"(?:{pattern.pattern})|{ARCHIVE_NAME}", pattern.flags)
+
+class LimitReached(Exception):
+    """An archive exceeded its byte or member cap."""
+
+class ArchiveReader:
+    """Stream the members of archives, within caps per archive."""
+
+    def __init__(self, pattern, max_bytes=DEFAULT_MAX_BYTES, max_members=DEFAULT_MAX_MEMBERS):
+        self.pattern = pattern
+        self.max_bytes = max_bytes
+        self.max_members = max_members
+
+    @classmethod
+    def from_args(cls, args):
+        """Build an ArchiveReader from the command line options."""
+        return cls(re.compile(args.regex), args.archive_max_bytes, args.archive_max_members)
+
+    def members(self, filepath):
+        """Yield (member name, data) for the matching members of an archive.
+
+        Reading stops, with a message, at the first error or cap reached;
+        the members already yielded stand.
+        """
+        budget = {"bytes": self.max_bytes, "members": self.max_members}
+        name = filepath.lower()
+        if name.endswith(TAR_SUFFIXES):
+            members = self._tar_members(filepath, budget)
+        elif name.endswith(".zip"):
+            members = self._zip_members(filepath, budget)
+        else:
+            members = self._gzip_members(filepath, budget)
+        try:
+            yield from members
+        except LimitReached:
+            print(f"Archive limit reached :: {filepath}")
+        except ARCHIVE_ERRORS:
+            print(f"Could not read archive :: {filepath}")
+
+    def wanted(self, member, budget):
+        """Count a member against the cap, returning whether its name matches."""
+        budget["members"] -= 1
+        if budget["members"] < 0:
+            raise LimitReached(member)
+        return bool(self.pattern.search(posixpath.basename(member)))
+
+    @staticmethod
+    def read(handle, budget, size=None):
+        """Read a member from handle within the byte budget.
+
+        size is the member's size where reading is unavoidable (tar
+        streams); it is charged even when the data is not wanted.
+        """
+        data = handle.read(budget["bytes"] + 1) if handle is not None else b""
+        budget["bytes"] -= max(len(data), size or 0)
+        if budget["bytes"] < 0:
+            raise LimitReached()
+        return data
+
+    def _zip_members(self, filepath, budget):
+        """Yield the matching members of a zip file."""
+        with zipfile.ZipFile(filepath) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not self.wanted(info.filename, budget):
+                    continue
+                if info.file_size > budget["bytes"]:
+                    # Declared sizes can lie, so read() checks again
+                    raise LimitReached(info.filename)
+                with archive.open(info) as handle:
+                    yield info.filename, self.read(handle, budget)
+
+    def _tar_members(self, filepath, budget):
+        """Yield the matching members of a tar file, in a single pass."""
+        with tarfile.open(filepath, mode="r|*") as archive:
+            for info in archive:
+                if not info.isfile():
+                    continue
+                if not self.wanted(info.name, budget):
+                    # The stream still decompresses the member to skip it
+                    self.read(None, budget, info.size)
+                    continue
+                yield info.name, self.read(archive.extractfile(info), budget, info.size)
+
+    def _gzip_members(self, filepath, budget):
+        """Yield the single member of a gzip file, named without .gz."""
+        member = posixpath.basename(filepath)[:-3]
+        if self.wanted(member, budget):
+            with gzip.open(filepath, "rb") as handle:
+                yield member, self.read(handle, budget)
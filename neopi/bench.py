@@ -0,0 +1,291 @@
+"""Throughput benchmark on a reproducible synthetic corpus.
+
+Generates plain and minified PHP/JS, packed webshells and binary blobs from
+a fixed seed, then times every test, file discovery and the end-to-end
+scan. The JSON report can be compared with one from an earlier run:
+
+    python -m neopi.bench --out new.json --compare old.json
+"""
+
+import argparse
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import time
+import zlib
+from .cli import create_arg_parser, process_files
+from .search import SearchFile
+from .tests import (
+    AnalysisContext,
+    LanguageIC, Entropy, LongestWord,
+    SignatureNasty, SignatureSuperNasty, UsesEval, Compression
+)
+from .tests.compression import ZLIB_MODES
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+KINDS = ("php", "js", "minified", "packed", "binary")
+
+PHP_LINES = [
+    "$user = $this->session->get('user_id');",
+    "if (isset($_POST['title']) && strlen($_POST['title']) > 0) {",
+    "    $title = htmlspecialchars(trim($_POST['title']), ENT_QUOTES, 'UTF-8');",
+    "}",
+    "foreach ($items as $key => $item) {",
+    "    echo '<li>' . esc_html($item['name']) . '</li>';",
+    "$query = $db->prepare('SELECT * FROM posts WHERE id = ?');",
+    "return array_map(function ($row) { return $row['id']; }, $rows);",
+    "// Render the sidebar widgets for the current theme",
+    "public function getCommentCount($postId) {",
+]
+
+JS_LINES = [
+    "const items = document.querySelectorAll('.menu-item');",
+    "items.forEach(function (item) { item.classList.remove('active'); });",
+    "export function debounce(callback, wait) {",
+    "  let timeout = null;",
+    "  return (...args) => {",
+    "    clearTimeout(timeout);",
+    "    timeout = setTimeout(() => callback(...args), wait);",
+    "  };",
+    "}",
+    "// Fetch the next page of results and append them to the list",
+    "fetch(url).then((response) => response.json()).then(render);",
+]
+
+def _text(rng, lines, size):
+    """Join random source lines until size bytes."""
+    out = []
+    length = 0
+    while length < size:
+        line = rng.choice(lines)
+        out.append(line)
+        length += len(line) + 1
+    return "\n".join(out).encode()[:size]
+
+def _minified(rng, size):
+    """Return a single-line, minified-looking JS bundle."""
+    names = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(2))
+             for _ in range(64)]
+    out = []
+    length = 0
+    while length < size:
+        part = f"var {rng.choice(names)}=function({rng.choice(names)}){{return " \
+               f"{rng.choice(names)}.{rng.choice(names)}({rng.randint(0, 999)})}};"
+        out.append(part)
+        length += len(part)
+    return "".join(out).encode()[:size]
+
+def _packed(rng, size):
+    """Return a gzinflate/base64 packed shell of roughly size bytes."""
+    body = _text(rng, PHP_LINES + ["system($_GET['cmd']);", "eval($_POST['code']);"], size)
+    payload = base64.b64encode(zlib.compress(body, 9)[2:-4]).decode()
+    shell = f"<?php eval(gzinflate(base64_decode('{payload}'))); ?>".encode()
+    # Pad with more packed payload until the size is reached
+    while len(shell) < size:
+        shell += f"\n$_{rng.randint(0, 99)} = '{payload}';".encode()
+    return shell[:size]
+
+def _binary(rng, size):
+    """Return size random bytes."""
+    return rng.getrandbits(8 * size).to_bytes(size, "little")
+
+def make_file(rng, kind, size):
+    """Return the content of one synthetic file of the given kind."""
+    if kind == "php":
+        return b"<?php\n" + _text(rng, PHP_LINES, size - 6)
+    if kind == "js":
+        return _text(rng, JS_LINES, size)
+    if kind == "minified":
+        return _minified(rng, size)
+    if kind == "packed":
+        return _packed(rng, size)
+    return _binary(rng, size)
+
+def generate_corpus(directory, files=200, size=16384, seed=0):
+    """Write a reproducible corpus of files under directory.
+
+    Kinds are assigned round-robin and sizes vary between half and one and
+    a half times size. Returns (file count, total bytes, sha1 of contents),
+    the digest identifying the corpus in reports.
+    """
+    rng = random.Random(seed)
+    digest = hashlib.sha1()
+    total = 0
+    extensions = {"php": "php", "js": "js", "minified": "min.js",
+                  "packed": "php", "binary": "dat"}
+    for idx in range(files):
+        kind = KINDS[idx % len(KINDS)]
+        subdir = os.path.join(directory, f"dir{idx % 10}")
+        os.makedirs(subdir, exist_ok=True)
+        data = make_file(rng, kind, max(rng.randint(size // 2, size * 3 // 2), 64))
+        with open(os.path.join(subdir, f"{kind}{idx}.{extensions[kind]}"), "wb") as handle:
+            handle.write(data)
+        digest.update(data)
+        total += len(data)
+    return files, total, digest.hexdigest()
+
+def _rate(count, total_bytes, seconds):
+    """Throughput figures for one timed phase."""
+    seconds = max(seconds, 1e-9)
+    return {
+        "seconds": round(seconds, 6),
+        "files_per_s": round(count / seconds, 2),
+        "mb_per_s": round(total_bytes / seconds / 1e6, 3),
+    }
+
+def bench_tests(corpus, repeat=1, block_size=None):
+    """Time measure() (or block_measure()) of each test over in-memory data."""
+    tests = [LanguageIC(), Entropy(), LongestWord(), SignatureNasty(),
+             SignatureSuperNasty(), UsesEval()]
+    tests += [Compression(mode) for mode in ZLIB_MODES]
+    total = sum(len(data) for data in corpus)
+    report = {}
+    for test in tests:
+        best = None
+        for _ in range(repeat):
+            # A fresh context per file, so each test pays for its own views
+            start = time.perf_counter()
+            for data in corpus:
+                if block_size:
+                    test.block_measure(block_size, AnalysisContext(data))
+                else:
+                    test.measure(AnalysisContext(data))
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        name = test.__class__.__name__
+        if isinstance(test, Compression) and test.mode != "exact":
+            name += f"[{test.mode}]"
+        report[name] = _rate(len(corpus), total, best)
+    return report
+
+def bench_discovery(directory, total, repeat=1):
+    """Time SearchFile candidate discovery."""
+    best = None
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = sum(1 for _ in SearchFile().iter_candidates(directory, re.compile(".*")))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return _rate(count, total, best)
+
+def bench_scan(directory, total, options=()):
+    """Time cli.process_files with all tests, as `neopi DIR -a` runs them.
+
+    options are extra command line options for the scan.
+    """
+    args = create_arg_parser([directory, "-a"] + list(options))
+    tests = [LanguageIC(), Entropy(), LongestWord(), SignatureNasty(), SignatureSuperNasty()]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        file_count, _, _ = process_files(args, tests, re.compile(args.regex))
+    return _rate(file_count, total, time.perf_counter() - start)
+
+def peak_rss():
+    """Return the peak RSS in KiB of this process and of its children."""
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS and KiB elsewhere
+    scale = 1024 if sys.platform == "darwin" else 1
+    return {
+        "self_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+        "children_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale,
+    }
+
+def scan_options(args):
+    """Command line options for the end-to-end scan."""
+    options = []
+    if args.jobs:
+        options += ["-j", str(args.jobs)]
+    if args.io_concurrency:
+        options += ["--io-concurrency", str(args.io_concurrency)]
+    if args.latency:
+        options += ["--io-latency", str(args.latency / 1000.0)]
+    return options
+
+def run(args):
+    """Generate the corpus, run every benchmark and return the report."""
+    with tempfile.TemporaryDirectory(prefix="neopi-bench-") as tmpdir:
+        directory = args.corpus or tmpdir
+        count, total, digest = generate_corpus(directory, args.files, args.size, args.seed)
+        corpus = []
+        for filepath, _ in SearchFile().iter_candidates(directory, re.compile(".*")):
+            with open(filepath, "rb") as handle:
+                corpus.append(handle.read())
+        return {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "corpus": {"files": count, "bytes": total, "seed": args.seed, "sha1": digest},
+            "tests": bench_tests(corpus, args.repeat, args.block_size),
+            "discovery": bench_discovery(directory, total, args.repeat),
+            "scan": bench_scan(directory, total, scan_options(args)),
+            "peak_rss": peak_rss(),
+        }
+
+def compare(old, new):
+    """Print the change in MB/s of every timed phase between two reports."""
+    if old.get("corpus", {}).get("sha1") != new["corpus"]["sha1"]:
+        print("Warning: the reports were made on different corpora")
+    phases = [(f"tests.{name}", old.get("tests", {}).get(name), rate)
+              for name, rate in new["tests"].items()]
+    phases += [(name, old.get(name), new[name]) for name in ("discovery", "scan")]
+    print(f" {'Phase':<32} {'Old MB/s':>10} {'New MB/s':>10} {'Change':>8}")
+    for name, before, after in phases:
+        if not before:
+            continue
+        change = (after["mb_per_s"] / max(before["mb_per_s"], 1e-9) - 1) * 100
+        print(f" {name:<32} {before['mb_per_s']:>10.3f} {after['mb_per_s']:>10.3f} "
+              f"{change:>+7.1f}%")
+
+def main(argv=None):
+    """Entry point for python -m neopi.bench."""
+    parser = argparse.ArgumentParser(description="Benchmark neopi on a synthetic corpus")
+    parser.add_argument("--files", type=int, default=200, help="Number of files (default: 200)")
+    parser.add_argument("--size", type=int, default=16384,
+                        help="Average file size in bytes (default: 16384)")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus seed (default: 0)")
+    parser.add_argument("--corpus", metavar="DIR",
+                        help="Write the corpus to DIR and keep it (default: a temporary dir)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per test and discovery, best one is kept (default: 3)")
+    parser.add_argument("-b", "--block-size", type=int,
+                        help="Time block mode with this block size")
+    parser.add_argument("-j", "--jobs", type=int, help="Worker processes for the scan")
+    parser.add_argument("--io-concurrency", type=int, metavar="N",
+                        help="Read threads for the scan")
+    parser.add_argument("--latency", type=float, default=0.0, metavar="MS",
+                        help="Delay added before each file open in the scan, "
+                             "to simulate a network filesystem")
+    parser.add_argument("--out", metavar="FILE", help="Write the JSON report to FILE")
+    parser.add_argument("--compare", metavar="FILE", help="Compare with an earlier report")
+    args = parser.parse_args(argv)
+    if args.files < 1 or args.size < 64 or args.repeat < 1:
+        print("Error: --files and --repeat must be positive and --size at least 64")
+        return 1
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as handle:
+            handle.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as handle:
+            compare(json.load(handle), report)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
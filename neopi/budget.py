@@ -0,0 +1,74 @@
+"""CPU time budgets for the tests run on each file.
+
+A single pathological input, such as a lazy signature regex on a 30 MB
+one-line file, can keep a worker busy for minutes. With --time-budget
+(per file) and --test-budget (per test) each test runs under a CPU timer
+(setitimer's ITIMER_PROF); when it fires, the SIGPROF handler raises
+BudgetExceeded in the worker, which the regex engine and Python code notice
+right away (a long zlib call only at its end). The test then has no value
+for that file and the file is recorded as timed out.
+"""
+
+import signal
+import time
+
+class BudgetExceeded(Exception):
+    """Raised by the SIGPROF handler when a test runs out of CPU time."""
+
+def _expire(signum, frame):
+    """SIGPROF handler."""
+    raise BudgetExceeded(signum, frame)
+
+def supported():
+    """Whether CPU timers are available on this platform."""
+    return hasattr(signal, "setitimer")
+
+class CpuBudget:
+    """Limit the CPU time of the tests, per file and per test.
+
+    Only usable from the main thread of a process, where signal handlers
+    run; install() must be called there first.
+    """
+
+    def __init__(self, file_seconds=None, test_seconds=None):
+        self.file_seconds = file_seconds
+        self.test_seconds = test_seconds
+        self.deadline = None
+        # Names of the tests that ran out of time on the current file
+        self.expired = []
+
+    @classmethod
+    def from_args(cls, args):
+        """Build a CpuBudget from the command line options, or None."""
+        if not (args.time_budget or args.test_budget):
+            return None
+        return cls(args.time_budget, args.test_budget)
+
+    @staticmethod
+    def install():
+        """Make SIGPROF raise BudgetExceeded in this process."""
+        signal.signal(signal.SIGPROF, _expire)
+
+    def start(self):
+        """Start the budget of a new file."""
+        self.deadline = time.process_time() + self.file_seconds if self.file_seconds else None
+        self.expired = []
+
+    def run(self, name, func, *args):
+        """Return func(*args), or None if the test name runs out of time."""
+        limit = self.test_seconds
+        if self.deadline is not None:
+            remaining = self.deadline - time.process_time()
+            limit = remaining if limit is None else min(limit, remaining)
+        if limit <= 0:
+            self.expired.append(name)
+            return None
+        try:
+            signal.setitimer(signal.ITIMER_PROF, limit)
+            try:
+                return func(*args)
+            finally:
+                signal.setitimer(signal.ITIMER_PROF, 0)
+        except BudgetExceeded:
+            self.expired.append(name)
+            return None
@@ -0,0 +1,144 @@
+"""Persistent on-disk cache of test results."""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+DEFAULT_CACHE_FILE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "neopi", "results.sqlite"
+)
+DEFAULT_MAX_ENTRIES = 1000000  # Files kept before the least recently used are evicted
+COMMIT_INTERVAL = 1000  # Stores between commits
+SCHEMA_VERSION = 1
+
+# fresh: the file's (dev, inode, size, mtime) still match the cached ones
+# values: {test key: (value, position)} of every cached test
+CacheEntry = namedtuple("CacheEntry", ["fresh", "digest", "values"])
+
+def stat_key(stat):
+    """Return the part of a stat result that identifies unchanged content."""
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+class ResultCache:
+    """SQLite store of per-file test values keyed by path and stat data.
+
+    Each test value is stored under a key naming the test, its version and
+    any options that affect it, so one cache serves runs with different
+    test selections. Only the parent process touches the database; its
+    threads share the connection, one at a time.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_FILE, max_entries=DEFAULT_MAX_ENTRIES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.run = int(time.time())
+        self.uncommitted = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self._setup()
+
+    def _setup(self):
+        """Create the tables, discarding any cache with an older schema."""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.conn.executescript("""
+                DROP TABLE IF EXISTS results;
+                DROP TABLE IF EXISTS files;
+            """)
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER,
+                digest TEXT,
+                used INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                path TEXT,
+                key TEXT,
+                value,
+                position INTEGER,
+                PRIMARY KEY (path, key)
+            );
+            CREATE INDEX IF NOT EXISTS files_used ON files (used);
+            PRAGMA user_version = {SCHEMA_VERSION};
+        """)
+
+    def lookup(self, filepath, stat):
+        """Return the CacheEntry for filepath, or None if it was never cached."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT f.dev, f.ino, f.size, f.mtime_ns, f.digest, r.key, r.value, r.position "
+                "FROM files f LEFT JOIN results r ON r.path = f.path WHERE f.path = ?",
+                (filepath,)
+            ).fetchall()
+        if not rows:
+            return None
+        values = {row[5]: (row[6], row[7]) for row in rows if row[5] is not None}
+        return CacheEntry(tuple(rows[0][:4]) == stat_key(stat), rows[0][4], values)
+
+    def store(self, filepath, stat, digest, values, fresh=False):
+        """Store {test key: (value, position)} for filepath.
+
+        Unless fresh is set, values cached for older content are dropped.
+        """
+        with self.lock:
+            if not fresh:
+                self.conn.execute("DELETE FROM results WHERE path = ?", (filepath,))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (filepath, *stat_key(stat), digest, self.run)
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                [(filepath, key, value, position) for key, (value, position) in values.items()]
+            )
+            self._written()
+
+    def touch(self, filepath, stat=None):
+        """Mark filepath as used by this run, updating its stat data if given."""
+        with self.lock:
+            if stat is None:
+                self.conn.execute("UPDATE files SET used = ? WHERE path = ?",
+                                  (self.run, filepath))
+            else:
+                self.conn.execute(
+                    "UPDATE files SET dev = ?, ino = ?, size = ?, mtime_ns = ?, used = ? "
+                    "WHERE path = ?",
+                    (*stat_key(stat), self.run, filepath)
+                )
+            self._written()
+
+    def _written(self):
+        """Commit every COMMIT_INTERVAL writes. The caller holds the lock."""
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_INTERVAL:
+            self.conn.commit()
+            self.uncommitted = 0
+
+    def evict(self):
+        """Drop the least recently used files beyond max_entries."""
+        count = self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        self.conn.execute(
+            "CREATE TEMP TABLE evicted AS SELECT path FROM files ORDER BY used LIMIT ?",
+            (excess,)
+        )
+        self.conn.executescript("""
+            DELETE FROM results WHERE path IN (SELECT path FROM evicted);
+            DELETE FROM files WHERE path IN (SELECT path FROM evicted);
+            DROP TABLE evicted;
+        """)
+
+    def close(self):
+        """Evict, commit and close the database."""
+        self.evict()
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,66 @@
+"""Cheap prefilter gating the expensive tests.
+
+With --cascade every file first goes through a prefilter: the entropy of
+its first few KB and a case-insensitive search for suspicious literal
+tokens. Only files that trip either check are passed to the tests
+marked expensive (full zlib compression, longest word extraction); the
+others get no value for them but keep the scores of the cheap tests.
+"""
+
+import hashlib
+from .tests.entropy import shannon_entropy
+from .tests.utils import byte_histogram
+
+# Each token costs one pass over the file, so keep the list short
+DEFAULT_TOKENS = (
+    "eval", "assert", "base64", "gzinflate", "gzuncompress", "str_rot13",
+    "create_function", "system", "exec", "passthru", "chr(", "\\x",
+)
+DEFAULT_HEAD_BYTES = 8192  # Bytes whose entropy is checked
+DEFAULT_MIN_ENTROPY = 5.5  # Plain source code stays below this (bits/byte)
+SEARCH_CHUNK = 1 << 20  # Bytes lowercased at a time
+
+class Prefilter:
+    """Decide which files are worth running the expensive tests on."""
+
+    def __init__(self, tokens=DEFAULT_TOKENS, head_bytes=DEFAULT_HEAD_BYTES,
+                 min_entropy=DEFAULT_MIN_ENTROPY):
+        self.tokens = tuple(tokens)
+        self.head_bytes = head_bytes
+        self.min_entropy = min_entropy
+        self.needles = [token.lower().encode() for token in self.tokens if token]
+
+    @classmethod
+    def from_args(cls, args):
+        """Build a Prefilter from the command line options."""
+        return cls(DEFAULT_TOKENS + tuple(args.cascade_token or ()),
+                   args.cascade_head, args.cascade_entropy)
+
+    def digest(self):
+        """Identify the prefilter settings, for cache keys."""
+        settings = "\0".join(self.tokens) + f"\0{self.head_bytes}\0{self.min_entropy}"
+        return hashlib.sha1(settings.encode()).hexdigest()[:12]
+
+    def passes(self, data):
+        """Whether data has a high entropy head or contains a token."""
+        head = data[:self.head_bytes]
+        if shannon_entropy(byte_histogram(head), len(head)) >= self.min_entropy:
+            return True
+        return self.has_token(data)
+
+    def has_token(self, data):
+        """Search data for the tokens, ignoring case.
+
+        Lowercasing and substring search are both single C passes, far
+        quicker than a case-insensitive regex alternation. Chunks overlap
+        so tokens straddling a boundary are found.
+        """
+        if not self.needles:
+            return False
+        overlap = max(len(needle) for needle in self.needles) - 1
+        for start in range(0, len(data), SEARCH_CHUNK):
+            # Buffers such as memoryview slices have no lower()
+            chunk = bytes(data[start:start + SEARCH_CHUNK + overlap]).lower()
+            if any(needle in chunk for needle in self.needles):
+                return True
+        return False
@@ -1,21 +1,215 @@
 """Command line interface for neopi."""
 
 import argparse
+import json
 import os
 import re
+import sqlite3
+import sys
 import time
-import csv
-from typing import List, Dict, Any
+import zipfile
+from datetime import datetime
+from typing import List, Optional
+from .alarm import ALARM_STATS, COMBINE_MODES, STAT_UNITS, combined_ranking
+from .budget import supported as budget_supported
+from .archive import DEFAULT_MAX_BYTES as DEFAULT_ARCHIVE_BYTES, DEFAULT_MAX_MEMBERS
+from .cache import ResultCache, DEFAULT_CACHE_FILE, DEFAULT_MAX_ENTRIES
+from .cascade import DEFAULT_HEAD_BYTES, DEFAULT_MIN_ENTROPY
+from .partial import merge_partials, write_partial
+from .profiling import DEFAULT_PROFILE_TOP
+from .reader import OVERSIZE_POLICIES
+from .dedup import load_allowlist
+from .features import open_features
+from .engine import ScanEngine, SCANNED, TIMED_OUT, merge_row
+from .sinks import CsvSink, JsonlSink, TIMED_OUT_COLUMN, open_sinks
 from .search import SearchFile
+from .watch import WatchSession, make_watcher
 from .tests import (
     Test,
     LanguageIC, Entropy, LongestWord,
-    SignatureNasty, SignatureSuperNasty, UsesEval,
-    Compression
+    SignatureTest, SignatureNasty, SignatureSuperNasty, UsesEval,
+    Compression, default_rules, load_rules,
+    CompactResults, DEFAULT_TOP_K
 )
+from .tests.compression import ZLIB_MODES
+from .targets import listed_files
+from .scanner import Baseline
 
-def create_arg_parser() -> argparse.ArgumentParser:
-    """Create and configure argument parser."""
+AGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}  # Seconds per --since-mtime age unit
+
+def positive_int(text: str) -> int:
+    """argparse type for options that must be at least 1."""
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be positive: {value}")
+    return value
+
+def positive_float(text: str) -> float:
+    """argparse type for options that must be above 0."""
+    value = float(text)
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"must be positive: {value}")
+    return value
+
+def since_time(text: str) -> float:
+    """argparse type for a point in time, returned as seconds since the epoch.
+
+    Accepts seconds since the epoch, an ISO 8601 date or date and time
+    (local time unless it has an offset), or an age such as 90m, 12h or 2d.
+    """
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhd])", text)
+    if match:
+        return time.time() - float(match.group(1)) * AGE_UNITS[match.group(2)]
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(f"not a time or age: {text}") from err
+
+def add_alarm_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the alarm mode and combined ranking options to parser."""
+    parser.add_argument(
+        "-m", "--alarm-mode",
+        type=float,
+        help="Alarm mode outputs flags only files with high deviation"
+    )
+    parser.add_argument(
+        "--alarm-stat",
+        choices=ALARM_STATS,
+        default="stddev",
+        help="Deviation used by alarm mode: from the mean in standard deviations (default), "
+             "from the median in scaled MADs, or beyond the -m percentile"
+    )
+    parser.add_argument(
+        "--combine",
+        choices=COMBINE_MODES,
+        default="rank",
+        help="Top files over all tests by summed rank (default) or summed --alarm-stat score"
+    )
+
+def add_performance_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options tuning how files are read and analysed to parser."""
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        help="Number of worker processes (default: one per CPU, 1 runs in-process)"
+    )
+    parser.add_argument(
+        "--io-concurrency",
+        type=positive_int,
+        metavar="N",
+        help="Read files in N threads, overlapping with the analysis (for NFS/CIFS mounts)"
+    )
+    parser.add_argument(
+        "--io-latency",
+        type=float,
+        default=0.0,
+        help=argparse.SUPPRESS  # Seconds added before each open, for benchmarks
+    )
+    parser.add_argument(
+        "--largest-first",
+        action="store_true",
+        help="Scan the largest files first, handing them to workers in batches of similar "
+             "size (lists every file before scanning)"
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=positive_float,
+        metavar="SECONDS",
+        help="CPU seconds the tests may spend on one file; files running over are "
+             "reported as timed out"
+    )
+    parser.add_argument(
+        "--test-budget",
+        type=positive_float,
+        metavar="SECONDS",
+        help="CPU seconds one test may spend on one file"
+    )
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help="Run the expensive tests (zlib, longest word) only on files passing a cheap "
+             "prefilter of suspicious tokens and head entropy"
+    )
+    parser.add_argument(
+        "--cascade-token",
+        action="append",
+        metavar="TOKEN",
+        help="Extra prefilter token, matched case-insensitively (repeatable)"
+    )
+    parser.add_argument(
+        "--cascade-head",
+        type=int,
+        default=DEFAULT_HEAD_BYTES,
+        metavar="BYTES",
+        help=f"Bytes whose entropy the prefilter checks (default: {DEFAULT_HEAD_BYTES})"
+    )
+    parser.add_argument(
+        "--cascade-entropy",
+        type=float,
+        default=DEFAULT_MIN_ENTROPY,
+        metavar="BITS",
+        help=f"Head entropy passing the prefilter (default: {DEFAULT_MIN_ENTROPY})"
+    )
+
+def add_target_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options scanning given files instead of a whole tree to parser."""
+    listed = parser.add_mutually_exclusive_group()
+    listed.add_argument(
+        "--files-from",
+        metavar="FILE",
+        help="Scan the files listed in FILE ('-' for stdin), one per line or NUL delimited, "
+             "instead of walking a directory"
+    )
+    listed.add_argument(
+        "--changed-since",
+        metavar="REV",
+        help="Scan the files of the git checkout at directory changed since REV, "
+             "plus untracked files"
+    )
+    parser.add_argument(
+        "--since-mtime",
+        type=since_time,
+        metavar="WHEN",
+        help="Only scan files modified since WHEN: seconds since the epoch, an ISO 8601 "
+             "date/time or an age such as 90m, 12h or 2d"
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="FILENPZ",
+        help="In alarm mode, flag files against the statistics of a previous full scan "
+             "saved with --emit-partial"
+    )
+
+def add_export_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the partial result and feature export options to parser."""
+    parser.add_argument(
+        "--emit-partial",
+        metavar="FILENPZ",
+        help="Write per-test values and statistics to FILENPZ for `neopi merge`"
+    )
+    parser.add_argument(
+        "--partial-label",
+        metavar="NAME",
+        help="Prefix of this scan's files in merged results (default: the host name)"
+    )
+    parser.add_argument(
+        "--features",
+        metavar="PATH",
+        help="Export the values as typed columns: a directory of .npy files, an .npz file, "
+             "or a .parquet file (requires pyarrow)"
+    )
+    parser.add_argument(
+        "--features-histogram",
+        action="store_true",
+        help="Also export each file's 256 byte counts with --features"
+    )
+
+def create_arg_parser(argv=None) -> argparse.ArgumentParser:
+    """Create and configure argument parser, and parse argv (default: sys.argv)."""
     parser = argparse.ArgumentParser(
         description="Utility to scan a file path for encrypted and obfuscated files"
     )
@@ -23,7 +217,8 @@ def create_arg_parser() -> argparse.ArgumentParser:
     # Required arguments
     parser.add_argument(
         "directory",
-        help="Start directory"
+        nargs="?",
+        help="Start directory (optional with --files-from or --changed-since)"
     )
     parser.add_argument(
         "regex",
@@ -34,9 +229,20 @@ def create_arg_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "-c",
         "--csv",
-        help="Generate CSV outfile",
+        help="Generate CSV outfile, written as files complete (.gz/.zst to compress)",
         metavar="FILECSV"
     )
+    parser.add_argument(
+        "--jsonl",
+        help="Generate JSON Lines outfile, written as files complete (.gz/.zst to compress)",
+        metavar="FILEJSONL"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted scan: keep the rows already in the outfiles "
+             "and skip those files"
+    )
     parser.add_argument(
         "-a", "--all",
         action="store_true",
@@ -47,6 +253,12 @@ def create_arg_parser() -> argparse.ArgumentParser:
         action="store_true",
         help="Run compression Test"
     )
+    parser.add_argument(
+        "--zlib-mode",
+        choices=ZLIB_MODES,
+        help="How -z gets the compressed size: exact (default), stream (exact values, "
+             "no compressed copy), fast (level 1) or sample (8 chunks of 64 KB)"
+    )
     parser.add_argument(
         "-e", "--entropy",
         action="store_true",
@@ -65,21 +277,175 @@ def create_arg_parser() -> argparse.ArgumentParser:
     parser.add_argument("-i", "--ic", action="store_true", help="Run IC test")
     parser.add_argument("-s", "--signature", action="store_true", help="Run signature test")
     parser.add_argument("-S", "--supersignature", action="store_true", help="Run SUPER-signature")
+    parser.add_argument(
+        "--rules",
+        action="append",
+        metavar="RULEFILE",
+        help="Load extra signature rules from a JSON/YAML file (repeatable)"
+    )
     parser.add_argument("-u", "--unicode", action="store_true", help="Skip over unicode-y/UTF'y")
     parser.add_argument("-f", "--follow-links", action="store_true", help="Follow symbolic links")
     parser.add_argument(
-        "-m", "--alarm-mode",
-        type=float,
-        help="Alarm mode outputs flags only files with high deviation"
+        "-x", "--exclude",
+        action="append",
+        metavar="GLOB",
+        help="Skip files and directories whose name matches GLOB (repeatable)"
+    )
+    parser.add_argument(
+        "--min-size",
+        type=int,
+        metavar="BYTES",
+        help="Skip files smaller than BYTES"
+    )
+    parser.add_argument(
+        "--max-size",
+        type=int,
+        metavar="BYTES",
+        help="Skip files larger than BYTES"
+    )
+    parser.add_argument(
+        "--archives",
+        action="store_true",
+        help="Scan the members of zip, tar(.gz/.bz2/.xz) and gzip files instead of the "
+             "archives, reported as ARCHIVE!/MEMBER"
     )
+    parser.add_argument(
+        "--archive-max-bytes",
+        type=positive_int,
+        default=DEFAULT_ARCHIVE_BYTES,
+        metavar="BYTES",
+        help=f"Decompressed bytes read per archive (default: {DEFAULT_ARCHIVE_BYTES})"
+    )
+    parser.add_argument(
+        "--archive-max-members",
+        type=positive_int,
+        default=DEFAULT_MAX_MEMBERS,
+        metavar="N",
+        help=f"Members looked at per archive (default: {DEFAULT_MAX_MEMBERS})"
+    )
+    parser.add_argument(
+        "--max-bytes",
+        type=int,
+        metavar="BYTES",
+        help="Read at most BYTES of any file; larger files are handled per --oversize"
+    )
+    parser.add_argument(
+        "--oversize",
+        choices=OVERSIZE_POLICIES,
+        default="headtail",
+        help="Files over --max-bytes: analyse only their head and tail (default) or skip them"
+    )
+    add_alarm_arguments(parser)
     parser.add_argument(
         "-b", "--block-mode",
         type=int,
         help="Block mode calculates the tests selected for the specified block sizes in each file"
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--stride",
+        type=int,
+        help="Step between block mode windows; smaller than the block size gives "
+             "overlapping, sliding windows (default: block size)"
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Reuse results of unchanged files from previous runs"
+    )
+    parser.add_argument(
+        "--cache-file",
+        metavar="DBFILE",
+        help=f"Result cache database, implies --cache (default: {DEFAULT_CACHE_FILE})"
+    )
+    parser.add_argument(
+        "--cache-max-entries",
+        type=int,
+        default=DEFAULT_MAX_ENTRIES,
+        help="Files kept in the result cache before the least recently used are evicted"
+    )
+    parser.add_argument(
+        "--cache-verify",
+        action="store_true",
+        help="Also compare a content hash before trusting cached results"
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Hash files sharing their size with another and analyse each content once "
+             "per worker"
+    )
+    parser.add_argument(
+        "--allowlist",
+        metavar="FILE",
+        help="Skip files whose BLAKE2b-128 hash (`b2sum -l 128` output) is listed in FILE; "
+             "implies --dedup"
+    )
+    parser.add_argument(
+        "--low-memory",
+        action="store_true",
+        help="Keep results in compact arrays with running statistics; in alarm mode "
+             "only the --top-k most suspicious files per test are kept"
+    )
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        default=DEFAULT_TOP_K,
+        help=f"Results kept per test by --low-memory alarm mode (default: {DEFAULT_TOP_K})"
+    )
+    parser.add_argument(
+        "-w", "--watch",
+        action="store_true",
+        help="After the scan, keep watching the directory and rescan changed files"
+    )
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        default=2.0,
+        help="Seconds between polls when inotify is unavailable (default: 2)"
+    )
+    add_performance_arguments(parser)
+    add_target_arguments(parser)
+    add_export_arguments(parser)
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print CPU time, bytes and calls per test, read/walk time and the slowest files"
+    )
+    parser.add_argument(
+        "--profile-top",
+        type=int,
+        default=DEFAULT_PROFILE_TOP,
+        metavar="N",
+        help=f"Slowest files listed per test with --profile (default: {DEFAULT_PROFILE_TOP})"
+    )
+    parser.add_argument(
+        "--profile-out",
+        metavar="FILEJSON",
+        help="Also write the --profile figures as JSON (implies --profile)"
+    )
+    args = parser.parse_args(argv)
+    args.profile = args.profile or bool(args.profile_out)
+    return args
 
-def get_tests(args: argparse.Namespace) -> List[Test]:
+def get_rules(args: argparse.Namespace):
+    """Return the default signature rules plus any given with --rules."""
+    rules = default_rules()
+    for path in args.rules or []:
+        rules = rules + load_rules(path)
+    known = {cls.category for cls in SignatureTest.__subclasses__()}
+    unknown = rules.categories() - known
+    if unknown:
+        raise ValueError(f"unknown rule categories: {', '.join(sorted(unknown))}")
+    # Rules are reported and told apart by name
+    names = set()
+    duplicates = set()
+    for rule in rules.rules:
+        (duplicates if rule.name in names else names).add(rule.name)
+    if duplicates:
+        raise ValueError(f"duplicate rule names: {', '.join(sorted(duplicates))}")
+    return rules
+
+def get_tests(args: argparse.Namespace, rules=None) -> List[Test]:
     """Get list of tests to run based on arguments."""
     test_map = {
         'entropy': Entropy,
@@ -95,138 +461,378 @@ def get_tests(args: argparse.Namespace) -> List[Test]:
     if args.all:
         tests.extend([
             LanguageIC(), Entropy(), LongestWord(),
-            SignatureNasty(), SignatureSuperNasty()
+            SignatureNasty(rules), SignatureSuperNasty(rules)
         ])
         return tests
 
     for arg_name, test_class in test_map.items():
         if getattr(args, arg_name, False):
-            tests.append(test_class())
+            if issubclass(test_class, SignatureTest):
+                tests.append(test_class(rules))
+            elif test_class is Compression:
+                tests.append(Compression(args.zlib_mode or "exact"))
+            else:
+                tests.append(test_class())
 
     return tests
 
-def write_csv(filename: str, header: List[str], rows: List[List[Any]]) -> None:
-    """Write results to CSV file."""
-    with open(filename, "w", newline='', encoding='utf-8') as csv_file:
-        writer = csv.writer(csv_file)
-        writer.writerow(header)
-        writer.writerows(rows)
+def use_compact_results(tests: List[Test], args: argparse.Namespace) -> None:
+    """Switch the tests to the low-memory result store.
 
-def process_file(data: bytes, filename: str, tests: List[Test],args: argparse.Namespace)->List[Any]:
-    """Process a single file with all tests."""
-    if args.unicode:
-        try:
-            text_data = data.decode('utf-8')
-            ascii_high_count = sum(1 for c in text_data if ord(c) > 127)
-            file_ascii_ratio = float(ascii_high_count) / float(len(text_data))
-            if file_ascii_ratio >= 0.1:
-                return []
-        except (UnicodeDecodeError, ValueError):
-            pass
+    Cumulative ranking and watch mode need every value; alarm mode only
+    needs the running statistics and the most suspicious results.
+    """
+    keep_all = not args.alarm_mode or args.watch
+    for test in tests:
+        test.results = CompactResults(test.high_is_bad, keep_all, args.top_k)
 
-    csv_row = [filename]
+def result_header(tests: List[Test], args: argparse.Namespace) -> List[str]:
+    """Return the column names of the result rows.
 
+    With a CPU budget, a last timed_out column names the tests that ran out
+    of it on each file, blank for files where none did.
+    """
+    header = ["filename"]
     for test in tests:
+        header.append(test.__class__.__name__)
         if args.block_mode:
-            result = test.block_calculate(args.block_mode, data, filename)
-            csv_row.extend([result["value"], result["position"]])
-        else:
-            result = test.calculate(data, filename)
-            csv_row.append(result)
+            header.append("position")
+    if args.time_budget or args.test_budget:
+        header.append(TIMED_OUT_COLUMN)
+    return header
 
-    return csv_row
+def get_sinks(args: argparse.Namespace, tests: List[Test]):
+    """Open the requested result outputs."""
+    outputs = [(cls, path) for cls, path in ((CsvSink, args.csv), (JsonlSink, args.jsonl))
+               if path]
+    header = result_header(tests, args)
+    sink = open_sinks(outputs, header, args.resume)
+    if args.features:
+        try:
+            sink.features = open_features(args.features, header, args.features_histogram)
+        except (OSError, ValueError):
+            sink.close()
+            raise
+        # Resumed rows are in the outfiles already, but not in the new export
+        for row in sink.resumed:
+            sink.features.write(row)
+    return sink
 
-def print_summary(file_count: int, file_ignore_count: int, scan_time: float) -> None:
+def print_summary(file_count: int, file_ignore_count: int, scan_time: float,
+                  timed_out: Optional[int] = None) -> None:
     """Print summary statistics."""
     print(f"\n[[ Total files scanned: {file_count} ]]")
     print(f"[[ Total files ignored: {file_ignore_count} ]]")
+    if timed_out is not None:
+        print(f"[[ Total files timed out: {timed_out} ]]")
     print(f"[[ Scan Time: {scan_time:.2f} seconds ]]")
 
-def print_results(tests: List[Test], rank_list: Dict[str, float], args: argparse.Namespace) -> None:
-    """Print test results and rankings."""
+def print_results(tests: List[Test], args: argparse.Namespace, baseline=None) -> None:
+    """Print test results and rankings.
+
+    In alarm mode, files are flagged against the statistics of baseline
+    (a scanner.Baseline) if given, rather than of the files scanned.
+    """
+    # Combined over the values in the order recorded, before sort() reorders them
+    combined = None if args.alarm_mode else combined_ranking(tests, args.combine, args.alarm_stat)
+    unit = STAT_UNITS[args.alarm_stat]
     for test in tests:
         if args.alarm_mode:
+            reference = baseline.entries[test.fingerprint()] if baseline is not None else None
             print(f"Flagged files for: {test.__class__.__name__}")
-            test.flag_alarm(args.alarm_mode)
+            for res in test.flag_alarm(args.alarm_mode, args.alarm_stat, reference):
+                print(f' {res["value"]:>7.4f}   {res["percentage"]:>6.2f} {unit:<3}  '
+                      f'{res["filename"]}')
         else:
             test.sort()
             test.printer(10, args.block_mode)
-            for file in test.results:
-                rank_list[file["filename"]] = rank_list.get(file["filename"], 0) + file["rank"]
 
-    if not args.alarm_mode:
-        rank_sorted = sorted(rank_list.items(), key=lambda x: x[1])
+    if args.combine == "score" and combined is not None:
+        print("\n[[ Top combined scores ]]")
+        for filename, score in combined:
+            print(f' {score:>7.4f}        {filename}')
+    elif combined is not None:
         print("\n[[ Top cumulative ranked files ]]")
-        count = min(10, len(rank_sorted))
-        for idx in range(count):
-            print(f' {rank_sorted[idx][1]:>7}        {rank_sorted[idx][0]}')
-
-def process_files(args, tests, valid_regex) -> tuple:
-    """Process all files and collect results."""
-    locator = SearchFile(args.follow_links)
-    csv_array = []
-    csv_header = ["filename"]
+        for filename, rank in combined:
+            print(f' {rank:>7}        {filename}')
+
+def open_cache(args: argparse.Namespace):
+    """Open the result cache if caching was requested."""
+    if not (args.cache or args.cache_file or args.cache_verify):
+        return None
+    return ResultCache(args.cache_file or DEFAULT_CACHE_FILE, args.cache_max_entries)
+
+def open_outputs(args: argparse.Namespace, tests: List[Test]) -> tuple:
+    """Open the result cache and outfiles, returning (cache, sink)."""
+    try:
+        cache = open_cache(args)
+    except (OSError, sqlite3.Error) as err:
+        raise ValueError(f"Could not open result cache: {err}") from err
+    try:
+        return cache, get_sinks(args, tests)
+    except (OSError, ValueError) as err:
+        if cache is not None:
+            cache.close()
+        raise ValueError(f"Could not open output: {err}") from err
+
+def process_files(args, tests, valid_regex, cache=None, sink=None) -> tuple:
+    """Process all files, writing each result row to sink as it completes.
+
+    Returns (file count, ignored file count, ScanEngine); the engine holds
+    the profile and dedup report of the scan.
+    """
     file_count = 0
     file_ignore_count = 0
 
-    # Setup CSV headers
-    for test in tests:
-        csv_header.append(test.__class__.__name__)
-        if args.block_mode:
-            csv_header.append("position")
+    budgeted = args.time_budget or args.test_budget
+    engine = ScanEngine(tests, valid_regex, args, cache)
+
+    # Rows recovered from an interrupted scan count as scanned
+    skip = set()
+    for row in sink.resumed if sink else []:
+        merge_row(tests, row, args.block_mode)
+        # Archives are reopened, but their members in the outfile are not reported again
+        skip.add(row[0])
+        file_count += 1
+        if budgeted and row[-1]:
+            engine.timed_out[row[0]] = row[-1].split()
 
     # Process files
-    for data, filename in locator.search_file_path([args.directory], valid_regex):
-        if not data:
+    for record in engine.scan(args.directory, skip, getattr(args, "files", None)):
+        if record is None:
             continue
 
-        csv_row = process_file(data, filename, tests, args)
-        if csv_row:
-            csv_array.append(csv_row)
+        # Timed out files keep the values of the tests that finished
+        if record.status in (SCANNED, TIMED_OUT):
+            if sink:
+                row = [record.filename] + record.values
+                if budgeted:
+                    row.append(" ".join(record.expired) if record.expired else None)
+                sink.write(row, record.histogram)
             file_count += 1
         else:
             file_ignore_count += 1
 
-    return csv_array, csv_header, file_count, file_ignore_count
+    return file_count, file_ignore_count, engine
+
+def create_merge_parser(argv=None) -> argparse.Namespace:
+    """Create the `neopi merge` argument parser, and parse argv."""
+    parser = argparse.ArgumentParser(
+        prog="neopi merge",
+        description="Combine the partial results of several scans (--emit-partial)"
+    )
+    parser.add_argument("partials", nargs="+", metavar="FILENPZ", help="Partial result files")
+    add_alarm_arguments(parser)
+    return parser.parse_args(argv)
+
+def merge_main(argv=None) -> int:
+    """Print alarms or rankings over the merged partial results."""
+    args = create_merge_parser(argv)
+    error = check_alarm_args(args)
+    if error:
+        print(f"Error: {error}")
+        return 1
+    try:
+        tests, meta, file_count = merge_partials(args.partials)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as err:
+        print(f"Error: Invalid partial: {err}")
+        return 1
+
+    args.block_mode = meta["block_mode"]
+    print(f"\n[[ Merged {len(args.partials)} partials: {file_count} files ]]")
+    print_results(tests, args)
+    return 0
+
+def print_profile(profile, args: argparse.Namespace) -> None:
+    """Print the profile, and write it as JSON if requested."""
+    profile.printer()
+    if not args.profile_out:
+        return
+    try:
+        with open(args.profile_out, "w", encoding="utf-8") as handle:
+            json.dump(profile.as_dict(), handle, indent=2)
+    except OSError:
+        print(f"Could not write profile :: {args.profile_out}")
+
+def check_alarm_args(args: argparse.Namespace) -> Optional[str]:
+    """Return an error message for invalid alarm options, or None."""
+    if args.alarm_stat == "percentile" and args.alarm_mode and not 0 < args.alarm_mode < 100:
+        return "-m must be between 0 and 100 with --alarm-stat percentile"
+    if getattr(args, "watch", False) and args.alarm_mode and args.alarm_stat != "stddev":
+        return "--watch alarms only support --alarm-stat stddev"
+    return None
+
+def check_target_args(args: argparse.Namespace) -> Optional[str]:
+    """Return an error message for an invalid directory or file list, or None."""
+    if args.directory is not None:
+        return None if os.path.exists(args.directory) else "Invalid path"
+    if not (args.files_from or args.changed_since):
+        return "A directory is required unless --files-from or --changed-since is given"
+    if args.watch:
+        return "--watch needs a directory"
+    return None
+
+def check_feature_args(args: argparse.Namespace) -> Optional[str]:
+    """Return an error message for invalid feature export options, or None."""
+    if args.features_histogram and not args.features:
+        return "--features-histogram needs --features"
+    if args.features_histogram and (args.resume or args.cache or args.cache_file or
+                                    args.cache_verify):
+        # Only files actually read have byte counts
+        return "--features-histogram cannot be used with --resume or the result cache"
+    return None
 
-def main() -> int:
-    """Main entry point for CLI."""
+def check_block_args(args: argparse.Namespace) -> Optional[str]:
+    """Return an error message for invalid block mode options, or None."""
+    if (args.block_mode is not None and args.block_mode < 1) or \
+            (args.stride is not None and args.stride < 1):
+        return "Block size and stride must be positive"
+    if args.stride is not None and args.block_mode is None:
+        return "--stride needs a block size (-b)"
+    return None
+
+def check_args(args: argparse.Namespace) -> Optional[str]:
+    """Return an error message for invalid arguments, or None."""
+    if args.zlib_mode and not args.zlib:
+        # -a does not run the compression test
+        return "--zlib-mode needs the compression test (-z)"
+    if args.top_k < 1:
+        return "--top-k must be positive"
+    if args.max_bytes is not None and args.max_bytes < 2:
+        return "--max-bytes must be at least 2"
+    if args.resume and not (args.csv or args.jsonl):
+        return "--resume needs an outfile (--csv or --jsonl)"
+    return None
+
+def main(argv=None) -> int:
+    """Main entry point for CLI.
+
+    `neopi merge ...` combines partial results; `neopi scan ...` is the
+    same as `neopi ...`.
+    """
     print("""
    yusuf81-modified-neopi
    """)
 
-    args = create_arg_parser()
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["merge"]:
+        return merge_main(argv[1:])
+    if argv[:1] == ["scan"]:
+        argv = argv[1:]
+    return scan_main(argv)
 
-    # Validate inputs
-    if not os.path.exists(args.directory):
-        print("Error: Invalid path")
-        return 1
+def prepare_scan(args: argparse.Namespace) -> tuple:
+    """Validate the options, returning (filename regex, tests).
+
+    Raises ValueError with the message to report for invalid options.
+    """
+    error = (check_target_args(args) or check_block_args(args) or check_args(args) or
+             check_feature_args(args) or check_alarm_args(args))
+    if error:
+        raise ValueError(error)
 
     try:
         valid_regex = re.compile(args.regex)
-    except re.error:
-        print("Error: Invalid regular expression")
-        return 1
+    except re.error as err:
+        raise ValueError("Invalid regular expression") from err
+
+    try:
+        rules = get_rules(args)
+    except (OSError, ValueError) as err:
+        raise ValueError(f"Invalid rules file: {err}") from err
+
+    if (args.time_budget or args.test_budget) and not budget_supported():
+        raise ValueError("CPU time budgets are not supported on this platform")
+
+    if args.allowlist:
+        try:
+            load_allowlist(args.allowlist)
+        except (OSError, ValueError) as err:
+            raise ValueError(f"Invalid allowlist: {err}") from err
 
-    tests = get_tests(args)
+    tests = get_tests(args, rules)
     if not tests:
-        print("Error: No tests specified")
+        raise ValueError("No tests specified")
+
+    try:
+        args.files = listed_files(args)
+    except ValueError as err:
+        raise ValueError(f"Invalid file list: {err}") from err
+    return valid_regex, tests
+
+def load_baseline(args: argparse.Namespace, tests: List[Test]) -> Optional[Baseline]:
+    """Load the --baseline statistics for tests, or return None without one.
+
+    Raises ValueError if the baseline cannot be used with these tests and
+    options.
+    """
+    if not args.baseline:
+        return None
+    if not args.alarm_mode:
+        raise ValueError("--baseline is only used in alarm mode (-m)")
+    try:
+        baseline = Baseline.from_partial(args.baseline, args.alarm_stat)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as err:
+        raise ValueError(f"Invalid baseline: {err}") from err
+    if baseline.block != (args.block_mode, args.stride):
+        raise ValueError("Invalid baseline: it was saved with other block mode options")
+    missing = [test.__class__.__name__ for test in tests
+               if test.fingerprint() not in baseline.entries]
+    if missing:
+        raise ValueError(f"Invalid baseline: no statistics for {', '.join(missing)}")
+    return baseline
+
+def scan_main(argv=None) -> int:
+    """Scan a directory and report on it."""
+    args = create_arg_parser(argv)
+
+    # Validate inputs
+    try:
+        valid_regex, tests = prepare_scan(args)
+        baseline = load_baseline(args, tests)
+    except ValueError as err:
+        print(f"Error: {err}")
         return 1
+    if args.low_memory:
+        use_compact_results(tests, args)
 
-    rank_list: Dict[str, float] = {}
     time_start = time.time()
     # Process all files
-    csv_array, csv_header, file_count, file_ignore_count = process_files(
-        args, tests, valid_regex
-    )
-
-    # Write results
-    if args.csv:
-        write_csv(args.csv, csv_header, csv_array)
+    try:
+        cache, sink = open_outputs(args, tests)
+    except ValueError as err:
+        print(f"Error: {err}")
+        return 1
+    # Watch from before the scan, so files changed while it runs are rescanned
+    watcher = None
+    if args.watch:
+        watcher = make_watcher(args.directory, SearchFile.from_args(args), args.watch_interval)
+    try:
+        file_count, file_ignore_count, engine = process_files(
+            args, tests, valid_regex, cache, sink
+        )
+    finally:
+        sink.close()
+        if cache is not None:
+            cache.close()
 
     # Print results
     scan_time = time.time() - time_start
-    print_summary(file_count, file_ignore_count, scan_time)
-    print_results(tests, rank_list, args)
+    budgeted = args.time_budget or args.test_budget
+    print_summary(file_count, file_ignore_count, scan_time,
+                  len(engine.timed_out) if budgeted else None)
+    if engine.dedup is not None:
+        engine.dedup.printer()
+    if args.emit_partial:
+        try:
+            write_partial(args.emit_partial, tests, args, file_count, engine.timed_out)
+        except OSError:
+            print(f"Could not write partial :: {args.emit_partial}")
+    if engine.profile is not None:
+        print_profile(engine.profile, args)
+    print_results(tests, args, baseline)
+
+    if watcher is not None:
+        WatchSession(tests, valid_regex, args).run(watcher)
 
     return 0
@@ -0,0 +1,95 @@
+"""Content-hash deduplication.
+
+Vendored libraries and backup copies put many identical files in a web
+root. With --dedup each worker hashes the files it reads and runs the tests
+only once per distinct content, handing the same values to every copy. To
+avoid hashing at all where no copy can exist, only files whose size is
+shared with another candidate are hashed. Files whose hash is in an
+--allowlist (known-good vendor files) are skipped entirely.
+"""
+
+import hashlib
+from collections import Counter
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+MEMO_SIZE = 100000  # Distinct contents remembered per worker
+
+def content_digest(data, allowlist=False):
+    """Return the hex content hash of data used for deduplication.
+
+    xxHash is used when installed, except with an allowlist, whose entries
+    are the 128-bit BLAKE2b digests printed by `b2sum -l 128`.
+    """
+    if xxhash is not None and not allowlist:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def load_allowlist(path):
+    """Return the set of digests listed in path.
+
+    Each line holds a hex digest, optionally followed by a filename as in
+    b2sum output; blank lines and lines starting with '#' are ignored.
+    """
+    digests = set()
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            fields = line.split()
+            if fields and not fields[0].startswith("#"):
+                digests.add(fields[0].lower().lstrip("\\"))
+    return digests
+
+def size_first(candidates, hash_all=False):
+    """Yield (filepath, stat, hash it) for (filepath, stat) candidates.
+
+    Only files whose size another candidate shares need hashing, which
+    means seeing every candidate first; those are yielded last, grouped by
+    size so copies tend to reach the same worker. With hash_all every file
+    is hashed and the candidates stay lazy.
+    """
+    if hash_all:
+        for filepath, stat in candidates:
+            yield filepath, stat, True
+        return
+
+    candidates = list(candidates)
+    sizes = Counter(stat.st_size for _, stat in candidates)
+    shared = []
+    for filepath, stat in candidates:
+        if sizes[stat.st_size] > 1:
+            shared.append((filepath, stat))
+        else:
+            yield filepath, stat, False
+    shared.sort(key=lambda found: found[1].st_size)
+    for filepath, stat in shared:
+        yield filepath, stat, True
+
+class DedupReport:
+    """Count duplicate and allowlisted files seen by a scan."""
+
+    def __init__(self):
+        self.contents = Counter()
+        self.allowed = 0
+
+    def add(self, content, allowed=False):
+        """Record a file with the given content hash."""
+        if allowed:
+            self.allowed += 1
+        else:
+            self.contents[content] += 1
+
+    @property
+    def duplicates(self):
+        """Return (files that copy another, distinct contents with copies)."""
+        copied = [count for count in self.contents.values() if count > 1]
+        return sum(copied) - len(copied), len(copied)
+
+    def printer(self):
+        """Print the duplicate and allowlist counts."""
+        copies, originals = self.duplicates
+        # Each worker keeps its own memo, so copies are not always analysed once
+        print(f"[[ Duplicate files: {copies} (copies of {originals} files) ]]")
+        print(f"[[ Allowlisted files: {self.allowed} ]]")
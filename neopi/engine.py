@@ -0,0 +1,523 @@
+"""Parallel scan engine.
+
+Each worker process reads a file, runs every selected test on it and sends
+back only a compact FileRecord (filename plus test values), so file bodies
+never cross the process boundary.
+"""
+
+import hashlib
+import os
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from functools import cached_property, partial
+from multiprocessing import Pool
+from .archive import SEPARATOR, archive_pattern, is_archive
+from .budget import CpuBudget
+from .cascade import Prefilter
+from .dedup import MEMO_SIZE, DedupReport, content_digest, load_allowlist, size_first
+from .profiling import ScanProfile
+from .reader import DEFERRED, FileReader, HeadTail
+from .search import SearchFile
+from .tests import AnalysisContext
+
+CHUNK_SIZE = 16  # Paths handed to a worker per round trip
+BATCHES_PER_WORKER = 8  # Batches of similar total size per worker with --largest-first
+UNICODE_KEY = "unicode-filter"  # Cache key recording the -u decision
+
+# Record statuses
+SCANNED = "scanned"
+IGNORED = "ignored"  # Skipped by the unicode filter
+UNCHANGED = "unchanged"  # Content matches the cached digest
+ALLOWED = "allowed"  # Content hash is in the --allowlist
+TIMED_OUT = "timed out"  # Scanned, but some tests ran out of CPU budget
+
+# values holds the test values in CSV column order; profile holds the
+# (size, read seconds, per-test CPU seconds) of the file with --profile;
+# content is the dedup hash of files that were hashed; histogram holds the
+# 256 byte counts of the file with --features-histogram; expired names the
+# tests that ran out of CPU budget on a TIMED_OUT file
+FileRecord = namedtuple("FileRecord",
+                        ["filename", "status", "values", "digest", "profile", "content",
+                         "histogram", "expired"],
+                        defaults=(None, None, None, None, None, None))
+
+# Per-process state, installed once by init_worker
+_WORKER = {}
+
+def init_worker(tests, args):
+    """Install the tests and options used by scan_item in this process."""
+    _WORKER["tests"] = tests
+    _WORKER["args"] = args
+    _WORKER["reader"] = FileReader.from_args(args)
+    _WORKER["prefilter"] = Prefilter.from_args(args) if args.cascade else None
+    _WORKER["allowlist"] = load_allowlist(args.allowlist) if args.allowlist else None
+    # Values of the contents analysed so far, by content hash
+    _WORKER["memo"] = {}
+    _WORKER["budget"] = CpuBudget.from_args(args)
+    if _WORKER["budget"] is not None:
+        _WORKER["budget"].install()
+
+def file_digest(data):
+    """Return the content hash used to validate cached results."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def analyse(data, tests, args, cpu_times=None, prefilter=None,  # pylint: disable=too-many-arguments
+            *, budget=None):
+    """Run all tests on data and return their values in CSV column order.
+
+    The data is wrapped in a single AnalysisContext (unless already one) so
+    the decoded text and byte histogram are computed once and shared by
+    every test. Returns an
+    empty list when the file is skipped by the unicode filter. If cpu_times
+    is a list, the CPU time of each test is appended to it. Expensive tests
+    get None values (and times) for files that do not pass prefilter. Given
+    a budget (a budget.CpuBudget installed in this process), tests running
+    out of it get None values too, and their names are left in its expired
+    list.
+    """
+    context = AnalysisContext.wrap(data)
+    if args.unicode:
+        ratio = context.unicode_ratio()
+        if ratio is not None and ratio >= 0.1:
+            return []
+
+    gated = prefilter is not None and not prefilter.passes(context.data)
+    if budget is not None:
+        budget.start()
+    width = 2 if args.block_mode else 1
+    values = []
+    for test in tests:
+        if gated and test.expensive:
+            values.extend([None] * width)
+            if cpu_times is not None:
+                cpu_times.append(None)
+            continue
+        start = time.process_time()
+        if budget is None:
+            column = measure_test(test, context, args)
+        else:
+            column = budget.run(test.__class__.__name__, measure_test, test, context, args)
+        values.extend(column or [None] * width)
+        if cpu_times is not None:
+            cpu_times.append(time.process_time() - start)
+    return values
+
+def measure_test(test, context, args):
+    """Return the values of one test on context, in CSV column order.
+
+    In block mode the head and tail of a file cut down by max_bytes are
+    measured apart, so no window spans the bytes left out, and positions
+    in the tail are given as file offsets.
+    """
+    if args.block_mode and isinstance(context.data, HeadTail):
+        view = memoryview(context.data)
+        head = test.block_measure(args.block_mode, view[:context.data.split], args.stride)
+        tail = test.block_measure(args.block_mode, view[context.data.split:], args.stride)
+        result = test.best_block([(head["position"], head["value"]),
+                                  (tail["position"] + context.data.tail_offset, tail["value"])])
+        return [result["value"], result["position"]]
+    if args.block_mode:
+        result = test.block_measure(args.block_mode, context, args.stride)
+        return [result["value"], result["position"]]
+    return [test.measure(context)]
+
+def read_item(reader, item):
+    """Read the file of a (filepath, digest, hash content) item with reader.
+
+    Returns (filepath, digest, hash content, data, read seconds) for
+    analyse_item. Read seconds are None for files left for analyse_item to
+    read: archives, and files the reader defers.
+    """
+    filepath, known_digest, hash_content = item
+    if reader.is_archive(filepath):
+        # Members are read one at a time by analyse_item
+        return filepath, known_digest, hash_content, None, None
+    start = time.perf_counter()
+    data = reader.read(filepath)
+    if data is DEFERRED:
+        return filepath, known_digest, hash_content, None, None
+    return filepath, known_digest, hash_content, data, time.perf_counter() - start
+
+def scan_item(item):
+    """Read and analyse a single file inside a worker.
+
+    item is a (filepath, digest, hash content) triple; when the file
+    content still hashes to digest the tests are skipped and an UNCHANGED
+    record is returned. Returns None for files that cannot be read, and a
+    list of member records for archives.
+    """
+    return analyse_item(read_item(_WORKER["reader"], item))
+
+def analyse_item(item):
+    """Analyse a file read by read_item inside a worker.
+
+    Files read_item did not read are read here, by this worker's reader.
+    """
+    if _WORKER["reader"].is_archive(item[0]):
+        return scan_archive(item[0])
+    if item[4] is None:
+        return scan_item(item[:3])
+    return analyse_data(item)
+
+def analyse_data(item):
+    """Analyse the data of a file or archive member inside a worker.
+
+    Hashed files reuse the values of an identical content this worker has
+    already analysed, and allowlisted ones get an ALLOWED record.
+    """
+    filepath, known_digest, hash_content, data, read_seconds = item
+    if not data:
+        return None
+    try:
+        digest = file_digest(data) if _WORKER["args"].cache_verify else None
+        if known_digest is not None and digest == known_digest:
+            return FileRecord(filepath, UNCHANGED, None, digest)
+        content = None
+        if hash_content:
+            content = content_digest(data, _WORKER["allowlist"] is not None)
+            if _WORKER["allowlist"] is not None and content in _WORKER["allowlist"]:
+                return FileRecord(filepath, ALLOWED, None, digest, content=content)
+            if content in _WORKER["memo"]:
+                values, histogram = _WORKER["memo"][content]
+                return FileRecord(filepath, SCANNED if values else IGNORED, values, digest,
+                                  content=content, histogram=histogram)
+        cpu_times = [] if _WORKER["args"].profile else None
+        context = AnalysisContext(data)
+        budget = _WORKER["budget"]
+        values = analyse(context, _WORKER["tests"], _WORKER["args"], cpu_times,
+                         _WORKER["prefilter"], budget=budget)
+        # Shared with the entropy test, so usually already counted
+        histogram = context.histogram if values and _WORKER["args"].features_histogram else None
+        status = SCANNED if values else IGNORED
+        if budget is not None and budget.expired:
+            print(f"Timed out :: {filepath} ({', '.join(budget.expired)})")
+            status = TIMED_OUT
+        elif content is not None:
+            if len(_WORKER["memo"]) >= MEMO_SIZE:
+                _WORKER["memo"].clear()
+            _WORKER["memo"][content] = (values, histogram)
+        profile = (len(data), read_seconds, cpu_times) if values and cpu_times else None
+        return FileRecord(filepath, status, values, digest, profile, content, histogram,
+                          list(budget.expired) if status == TIMED_OUT else None)
+    finally:
+        FileReader.release(data)
+
+def scan_archive(filepath):
+    """Analyse the members of an archive inside a worker, returning their records."""
+    hash_content = bool(_WORKER["args"].dedup or _WORKER["args"].allowlist)
+    members = _WORKER["reader"].archives.members(filepath)
+    records = []
+    while True:
+        start = time.perf_counter()
+        member = next(members, None)
+        if member is None:
+            return records
+        name, data = member
+        record = analyse_data((filepath + SEPARATOR + name, None, hash_content, data,
+                               time.perf_counter() - start))
+        if record is not None:
+            records.append(record)
+
+def scan_batch(batch):
+    """Scan a batch of items inside a worker, returning all their records."""
+    return list(expand(map(scan_item, batch)))
+
+def batches(work, sizes, workers):
+    """Group work, ordered largest first, into batches of similar total size.
+
+    The largest files go alone and smaller ones are grouped, up to
+    CHUNK_SIZE at a time, so every worker gets about BATCHES_PER_WORKER
+    batches and none is left grinding through a big file at the end.
+    """
+    target = sum(sizes) / (workers * BATCHES_PER_WORKER)
+    batch = []
+    batch_bytes = 0
+    for item, size in zip(work, sizes):
+        batch.append(item)
+        batch_bytes += size
+        if batch_bytes >= target or len(batch) >= CHUNK_SIZE:
+            yield batch
+            batch = []
+            batch_bytes = 0
+    if batch:
+        yield batch
+
+def expand(results):
+    """Yield the records of worker results, flattening the lists of archives."""
+    for result in results:
+        if isinstance(result, list):
+            yield from result
+        else:
+            yield result
+
+def drain(queue):
+    """Yield and remove the items of a deque, oldest first."""
+    while queue:
+        yield queue.popleft()
+
+def bounded_map(executor, func, items, limit):
+    """Yield func(item) for items in completion order, running at most limit at once.
+
+    Items are only taken from the iterable as results are consumed, so a
+    slow consumer holds back the producers.
+    """
+    pending = set()
+    for item in items:
+        pending.add(executor.submit(func, item))
+        if len(pending) >= limit:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    for future in as_completed(pending):
+        yield future.result()
+
+def bounded_apply(pool, func, items, limit):
+    """Yield func(item) computed in pool, with at most limit items queued."""
+    pending = deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= limit:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def merge_row(tests, row, block_mode=False):
+    """Record a CSV row (filename followed by values) into each test's results."""
+    filename = row[0]
+    width = 2 if block_mode else 1
+    for idx, test in enumerate(tests):
+        column = 1 + idx * width
+        if block_mode:
+            test.record(filename, row[column], row[column + 1])
+        else:
+            test.record(filename, row[column])
+
+def test_keys(tests, args):
+    """Return the cache key of each test under the current options."""
+    suffix = ""
+    if args.block_mode:
+        suffix = f":block{args.block_mode}/{args.stride or args.block_mode}"
+    if args.max_bytes is not None and args.oversize == "headtail":
+        suffix += f":headtail{args.max_bytes}"
+        if args.block_mode:
+            # Head and tail are measured apart (see measure_test)
+            suffix += ":apart"
+    # Expensive tests have no value for files the prefilter stops
+    gated = f":cascade{Prefilter.from_args(args).digest()}" if args.cascade else ""
+    return [test.fingerprint() + suffix + (gated if test.expensive else "") for test in tests]
+
+class ScanEngine:
+    """Dispatch files to worker processes and merge their records."""
+
+    def __init__(self, tests, pattern, args, cache=None):
+        self.tests = tests
+        self.pattern = pattern
+        self.args = args
+        self.cache = cache
+        # Tests that ran out of CPU budget, by file
+        self.timed_out = {}
+        self.profile = None
+        if args.profile:
+            names = [test.__class__.__name__ for test in tests]
+            self.profile = ScanProfile(names, args.profile_top)
+        self.dedup = DedupReport() if args.dedup or args.allowlist else None
+
+    @cached_property
+    def keys(self):
+        """Return the cache key of each test under the current options."""
+        return test_keys(self.tests, self.args)
+
+    def scan(self, directory, skip=None, files=None):
+        """Yield a FileRecord for every readable matching file under directory.
+
+        Records are merged into the tests as they arrive, so ranking and
+        alarm mode work exactly as if the tests had run in this process.
+        Given a list of files, those are scanned instead of walking
+        directory (excludes then apply to their names below directory, or
+        the current directory if None). Files in skip are left out, and
+        files whose results are cached are not read at all. With dedup,
+        files that may have a copy are hashed by the workers. With
+        archives, archives are found whatever their name and their members
+        are scanned (never cached); archives are always reopened, but only
+        their members not in skip are reported.
+        """
+        locator = SearchFile.from_args(self.args)
+        pattern = archive_pattern(self.pattern) if self.args.archives else self.pattern
+        if files is not None:
+            candidates = locator.iter_listed(files, pattern, directory or os.curdir)
+        else:
+            candidates = locator.iter_candidates(directory, pattern)
+        if skip:
+            candidates = (found for found in candidates if found[0] not in skip)
+        if self.profile is not None:
+            candidates = self.profile.timed(candidates)
+        if self.dedup is not None:
+            candidates = size_first(candidates, hash_all=bool(self.args.allowlist))
+        else:
+            candidates = ((filepath, stat, False) for filepath, stat in candidates)
+        if self.cache is None:
+            yield from self.merge(self.unseen(self.dispatch(*self.schedule(
+                (stat.st_size, (filepath, None, hash_content))
+                for filepath, stat, hash_content in candidates
+            )), skip))
+            return
+
+        # Files are looked up as the workers take them, so they start on the
+        # first miss; the lookups may run in a pool thread, so cached records
+        # wait in ready until this thread merges them
+        pending = {}
+        ready = deque()
+        work = self.lookups(candidates, pending, ready)
+        for record in self.unseen(self.dispatch(*self.schedule(work)), skip):
+            yield from self.merge(drain(ready))
+            if record is not None and record.filename in pending:
+                record = self.update_cache(record, *pending.pop(record.filename))
+            yield from self.merge([record])
+        yield from self.merge(drain(ready))
+
+    def lookups(self, candidates, pending, ready):
+        """Yield (size, item) for the candidates not answered by the cache.
+
+        Cached records are appended to ready, and the (stat, entry, record)
+        of each file yielded is stored in pending for update_cache.
+        """
+        for filepath, stat, hash_content in candidates:
+            if self.args.archives and is_archive(filepath):
+                yield stat.st_size, (filepath, None, hash_content)
+                continue
+            entry = self.cache.lookup(filepath, stat)
+            record = self.from_cache(filepath, entry)
+            if record is not None and entry.fresh and not self.args.cache_verify:
+                self.cache.touch(filepath)
+                ready.append(record)
+                continue
+            pending[filepath] = (stat, entry, record)
+            yield stat.st_size, (filepath, entry.digest if record is not None else None,
+                                 hash_content)
+
+    def unseen(self, records, skip):
+        """Drop the records of archive members in skip, e.g. written before a resume."""
+        if not (skip and self.args.archives):
+            return records
+        return (record for record in records
+                if record is None or record.filename not in skip)
+
+    def schedule(self, sized):
+        """Return (work, sizes) for dispatch from (size, item) pairs.
+
+        With largest_first, every item is collected and ordered from the
+        largest file down; otherwise items are passed on as found, and
+        without their sizes.
+        """
+        if not getattr(self.args, "largest_first", False):
+            return (item for _, item in sized), None
+        ordered = sorted(sized, key=lambda pair: pair[0], reverse=True)
+        return [item for _, item in ordered], [size for size, _ in ordered]
+
+    def dispatch(self, work, sizes=None):
+        """Scan (filepath, digest, hash content) items in worker processes.
+
+        Yields a record per file, or per member of an archive. Given the
+        sizes of the items, workers get them in batches of similar size.
+        """
+        yield from expand(self.execute(work, sizes))
+
+    def execute(self, work, sizes=None):
+        """Yield the results of scan_item for work, computed by the workers."""
+        initargs = (self.tests, self.args)
+        jobs = getattr(self.args, "jobs", None)
+
+        if self.args.io_concurrency:
+            yield from self.pipeline(work, jobs)
+            return
+
+        if jobs == 1:
+            init_worker(*initargs)
+            yield from map(scan_item, work)
+            return
+
+        with Pool(processes=jobs, initializer=init_worker, initargs=initargs) as pool:
+            if sizes is None:
+                yield from pool.imap_unordered(scan_item, work, chunksize=CHUNK_SIZE)
+            else:
+                workers = jobs or os.cpu_count() or 1
+                yield from pool.imap_unordered(scan_batch, batches(work, sizes, workers))
+
+    def pipeline(self, work, jobs):
+        """Read files in io_concurrency threads and analyse them as they arrive.
+
+        For network filesystems, where open() and read() latency dominates:
+        reads overlap each other and the analysis, and both stages only run
+        a bounded number of files ahead of the consumer.
+        """
+        initargs = (self.tests, self.args)
+        limit = self.args.io_concurrency
+        reader = FileReader.from_args(self.args)
+        if jobs != 1:
+            # Read data is pickled to the workers, which an mmap cannot be:
+            # files that would be mapped are left for the workers to map
+            reader.defer_threshold = reader.mmap_threshold
+
+        with ThreadPoolExecutor(max_workers=limit) as executor:
+            reads = bounded_map(executor, partial(read_item, reader), work, limit)
+            if jobs == 1:
+                init_worker(*initargs)
+                yield from map(analyse_item, reads)
+                return
+            with Pool(processes=jobs, initializer=init_worker, initargs=initargs) as pool:
+                queued = (jobs or os.cpu_count() or 1) * 4
+                yield from bounded_apply(pool, analyse_item, reads, queued)
+
+    def merge(self, records):
+        """Merge scanned records into the tests and pass every record on."""
+        for record in records:
+            if record is not None and record.content is not None and self.dedup is not None:
+                self.dedup.add(record.content, record.status == ALLOWED)
+            if record is not None and record.status == TIMED_OUT:
+                self.timed_out[record.filename] = record.expired
+            if record is not None and record.status in (SCANNED, TIMED_OUT):
+                merge_row(self.tests, [record.filename] + record.values, self.args.block_mode)
+                if record.profile is not None and self.profile is not None:
+                    self.profile.add(record.filename, record.profile)
+            yield record
+
+    def from_cache(self, filepath, entry):
+        """Build a record from a cache entry, or None if a test is missing."""
+        if entry is None:
+            return None
+        if self.args.unicode:
+            if UNICODE_KEY not in entry.values:
+                return None
+            if entry.values[UNICODE_KEY][0]:
+                return FileRecord(filepath, IGNORED, [], entry.digest)
+        values = []
+        for key in self.keys:
+            if key not in entry.values:
+                return None
+            value, position = entry.values[key]
+            values.extend([value, position] if self.args.block_mode else [value])
+        return FileRecord(filepath, SCANNED, values, entry.digest)
+
+    def update_cache(self, record, stat, entry, cached):
+        """Store a worker's record, or resolve an UNCHANGED one from the cache."""
+        if record.status == UNCHANGED:
+            self.cache.touch(record.filename, stat)
+            return cached
+
+        values = {}
+        if self.args.unicode:
+            values[UNICODE_KEY] = (int(record.status == IGNORED), None)
+        if record.status == SCANNED:
+            width = 2 if self.args.block_mode else 1
+            for idx, key in enumerate(self.keys):
+                column = record.values[idx * width:(idx + 1) * width]
+                values[key] = (column[0], column[1] if self.args.block_mode else None)
+
+        # Values of other tests stay valid only if the content is unchanged
+        if record.digest is None:
+            same_content = entry is not None and entry.fresh
+        else:
+            same_content = entry is not None and entry.digest == record.digest
+        self.cache.store(record.filename, stat, record.digest, values, same_content)
+        return record
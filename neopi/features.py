@@ -0,0 +1,236 @@
+"""Columnar feature export for offline triage and model training.
+
+With --features, the test values of every scanned file are written as
+typed columns rather than text rows, so they load straight into NumPy or
+pandas: one float64 column per test (NaN where a test has no value), an
+int64 column of positions per test in block mode (-1 where missing), with
+a CPU budget an int64 `timed_out` column whose bit i is set when the i-th
+test ran out of time (its NaN is then not a cascade-gated value) and,
+with --features-histogram, a (files, 256) uint32 block of byte counts
+taken from the entropy pass. Filenames are stored as a string table: their
+UTF-8 bytes end to end in `filename_bytes` and the offset of each in
+`filename_offsets` (one more than there are files).
+
+Rows are buffered CHUNK_ROWS at a time and then appended to the output:
+
+- DIR: a directory of .npy files, one per column, readable with
+  numpy.load(..., mmap_mode="r") and complete up to the last chunk
+  written even if the scan is interrupted
+- FILE.npz: the same columns in one .npz archive, assembled on close
+- FILE.parquet: one Parquet row group per chunk (requires pyarrow)
+"""
+
+import math
+import os
+import shutil
+import tempfile
+import zipfile
+from array import array
+from .npyio import NpyAppender
+from .sinks import TIMED_OUT_COLUMN, JsonlSink
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+CHUNK_ROWS = 65536  # Rows buffered before they are appended to the output
+HISTOGRAM_WIDTH = 256
+MAX_COUNT = (1 << 32) - 1  # Byte counts are stored as uint32
+
+def column_keys(header):
+    """Return (name, descr) of the value columns of result rows with header.
+
+    header is the CSV header; columns are named as in JSON Lines output,
+    where block mode positions are named after their test.
+    """
+    return [(key, "<i8" if key.endswith(".position") or key == TIMED_OUT_COLUMN else "<f8")
+            for key in JsonlSink.column_keys(header)[1:]]
+
+def timed_out_mask(names, columns):
+    """Return the timed_out bitmask of a timed_out cell (test names, or None)."""
+    tests = [name for name, descr in columns if descr == "<f8"]
+    return sum(1 << tests.index(name) for name in names.split()) if names else 0
+
+def encode_name(filename):
+    """Return the UTF-8 bytes of filename, keeping undecodable bytes as they were."""
+    return filename.encode("utf-8", "surrogateescape")
+
+class FeatureWriter:
+    """Base class for writers of result rows as columns.
+
+    Child classes append each chunk of columns to their output.
+    """
+
+    def __init__(self, path, header, histogram=False):
+        self.path = path
+        self.columns = column_keys(header)
+        self.histogram = histogram
+        # Buffered (row, byte counts) pairs
+        self.rows = []
+        # Total length of the filenames written so far
+        self.offset = 0
+
+    def write(self, row, histogram=None):
+        """Buffer a row (filename followed by values) and its byte counts."""
+        self.rows.append((row, histogram))
+        if len(self.rows) >= CHUNK_ROWS:
+            self.flush()
+
+    def chunk(self):
+        """Return the buffered rows as {name: (descr, values)}."""
+        names = [encode_name(row[0]) for row, _ in self.rows]
+        offsets = []
+        for name in names:
+            self.offset += len(name)
+            offsets.append(self.offset)
+        chunk = {
+            "filename_offsets": ("<i8", offsets),
+            "filename_bytes": ("|u1", b"".join(names)),
+        }
+        for idx, (name, descr) in enumerate(self.columns, 1):
+            if name == TIMED_OUT_COLUMN:
+                chunk[name] = (descr, [timed_out_mask(row[idx], self.columns)
+                                       for row, _ in self.rows])
+                continue
+            missing = -1 if descr == "<i8" else math.nan
+            chunk[name] = (descr, [missing if row[idx] is None else row[idx]
+                                   for row, _ in self.rows])
+        if self.histogram:
+            counts = array("I")
+            for _, histogram in self.rows:
+                counts.extend(min(count, MAX_COUNT) for count in histogram)
+            chunk["histogram"] = ("<u4", counts)
+        return chunk
+
+    def flush(self):
+        """Append the buffered rows to the output."""
+        if self.rows:
+            self.write_chunk(self.chunk())
+            self.rows = []
+
+    def write_chunk(self, chunk):
+        """Append a chunk of columns. Must be overridden by child classes."""
+        raise NotImplementedError("write_chunk must be implemented by child class")
+
+    def close(self):
+        """Write the remaining rows and finish the output."""
+        self.flush()
+
+class NpyFeatureWriter(FeatureWriter):
+    """Write each column to a .npy file in a directory."""
+
+    def __init__(self, path, header, histogram=False):
+        super().__init__(path, header, histogram)
+        os.makedirs(path, exist_ok=True)
+        self.files = {}
+        self.open_file("filename_offsets", "<i8").append([0])
+        self.open_file("filename_bytes", "|u1")
+        for name, descr in self.columns:
+            self.open_file(name, descr)
+        if histogram:
+            self.open_file("histogram", "<u4", HISTOGRAM_WIDTH)
+
+    def open_file(self, name, descr, width=None):
+        """Start the .npy file of a column."""
+        self.files[name] = NpyAppender(os.path.join(self.path, f"{name}.npy"), descr, width)
+        return self.files[name]
+
+    def write_chunk(self, chunk):
+        for name, (_, values) in chunk.items():
+            self.files[name].append(values)
+
+    def close(self):
+        super().close()
+        for appender in self.files.values():
+            appender.close()
+
+class NpzFeatureWriter(NpyFeatureWriter):
+    """Write the .npy files to a temporary directory and archive them on close."""
+
+    def __init__(self, path, header, histogram=False):
+        self.archive_path = path
+        directory = tempfile.mkdtemp(prefix=".neopi-features-",
+                                     dir=os.path.dirname(os.path.abspath(path)))
+        super().__init__(directory, header, histogram)
+
+    def close(self):
+        super().close()
+        try:
+            with zipfile.ZipFile(self.archive_path, "w", zipfile.ZIP_DEFLATED) as archive:
+                for name in self.files:
+                    archive.write(os.path.join(self.path, f"{name}.npy"), f"{name}.npy")
+        finally:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+class ParquetFeatureWriter(FeatureWriter):
+    """Write one Parquet row group per chunk.
+
+    Filenames are a binary column of their UTF-8 bytes, as encode_name()
+    returns them, since names that are not valid UTF-8 cannot be strings.
+    """
+
+    def __init__(self, path, header, histogram=False):
+        if pyarrow is None:
+            raise ValueError("the pyarrow package is required for .parquet output")
+        super().__init__(path, header, histogram)
+        fields = [("filename", pyarrow.binary())]
+        fields += [(name, pyarrow.int64() if descr == "<i8" else pyarrow.float64())
+                   for name, descr in self.columns]
+        if histogram:
+            fields.append(("histogram", pyarrow.list_(pyarrow.uint32(), HISTOGRAM_WIDTH)))
+        self.schema = pyarrow.schema(fields)
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def chunk(self):
+        chunk = {"filename": [encode_name(row[0]) for row, _ in self.rows]}
+        for idx, (name, _) in enumerate(self.columns, 1):
+            if name == TIMED_OUT_COLUMN:
+                chunk[name] = [timed_out_mask(row[idx], self.columns) for row, _ in self.rows]
+            else:
+                chunk[name] = [row[idx] for row, _ in self.rows]
+        if self.histogram:
+            chunk["histogram"] = [[min(count, MAX_COUNT) for count in histogram]
+                                  for _, histogram in self.rows]
+        return chunk
+
+    def write_chunk(self, chunk):
+        self.writer.write_table(pyarrow.table(chunk, schema=self.schema))
+
+    def close(self):
+        super().close()
+        self.writer.close()
+
+def open_features(path, header, histogram=False):
+    """Open the feature writer for path, chosen by its suffix."""
+    if path.endswith(".parquet"):
+        return ParquetFeatureWriter(path, header, histogram)
+    if path.endswith(".npz"):
+        return NpzFeatureWriter(path, header, histogram)
+    return NpyFeatureWriter(path, header, histogram)
+
+def load_features(path):
+    """Read a .npz or .npy directory feature export (requires NumPy).
+
+    Returns (filenames, {column name: array}); the filename table is
+    decoded and left out of the columns.
+    """
+    if np is None:
+        raise ImportError("numpy is required to load features")
+    if os.path.isdir(path):
+        columns = {name[:-4]: np.load(os.path.join(path, name), mmap_mode="r")
+                   for name in os.listdir(path) if name.endswith(".npy")}
+    else:
+        with np.load(path) as archive:
+            columns = {name: archive[name] for name in archive.files}
+    offsets = columns.pop("filename_offsets")
+    data = columns.pop("filename_bytes").tobytes()
+    filenames = [data[start:end].decode("utf-8", "surrogateescape")
+                 for start, end in zip(offsets[:-1], offsets[1:])]
+    return filenames, columns
@@ -0,0 +1,121 @@
+"""Minimal NumPy .npy/.npz reader and writer.
+
+Partial results are exchanged as .npz files so they can be inspected with
+numpy.load, but neopi itself does not need NumPy to write or read them.
+Only 1-d arrays of little-endian float64 ('<f8'), int64 ('<i8') and
+fixed-width unicode ('<U<n>') are supported, plus uint8 ('|u1') and
+uint32 ('<u4') arrays, 1-d or 2-d, for NpyAppender.
+"""
+
+import ast
+import struct
+import sys
+import zipfile
+from array import array
+
+MAGIC = b"\x93NUMPY\x01\x00"
+ALIGN = 64  # Header plus data offset alignment used by NumPy
+TYPECODES = {"<f8": "d", "<i8": "q", "<u4": "I", "|u1": "B"}
+HEADER_SIZE = 128  # Header size reserved by NpyAppender, enough for any length
+
+def unicode_descr(values):
+    """Return the narrowest '<U<n>' dtype holding every string in values."""
+    return f"<U{max((len(value) for value in values), default=0) or 1}"
+
+def encode_header(descr, shape, size=None):
+    """Return the .npy header for an array of the given shape (a tuple).
+
+    The header is padded to the NumPy alignment, or to size bytes.
+    """
+    header = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': {tuple(shape)!r}, }}"
+    used = len(MAGIC) + 2 + len(header) + 1
+    padding = size - used if size is not None else -used % ALIGN
+    header = (header + " " * padding + "\n").encode("latin1")
+    return MAGIC + struct.pack("<H", len(header)) + header
+
+def encode_data(values, descr):
+    """Return the raw little-endian data of values as descr."""
+    if descr.startswith("<U"):
+        width = int(descr[2:]) * 4
+        return b"".join(value.encode("utf-32-le").ljust(width, b"\0") for value in values)
+    packed = array(TYPECODES[descr], values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+def encode_array(values, descr):
+    """Return the content of a .npy file holding values as descr."""
+    return encode_header(descr, (len(values),)) + encode_data(values, descr)
+
+def decode_array(content):
+    """Return the values of a 1-d .npy file as a list."""
+    if not content.startswith(MAGIC[:6]):
+        raise ValueError("not a .npy file")
+    major = content[6]
+    size_format, offset = ("<H", 10) if major == 1 else ("<I", 12)
+    (header_length,) = struct.unpack_from(size_format, content, 8)
+    header = ast.literal_eval(content[offset:offset + header_length].decode("latin1"))
+    descr = header["descr"]
+    shape = header["shape"]
+    if header["fortran_order"] or len(shape) != 1:
+        raise ValueError("only 1-d arrays are supported")
+    data = content[offset + header_length:]
+    if descr.startswith("<U"):
+        width = int(descr[2:]) * 4
+        return [data[start:start + width].decode("utf-32-le").rstrip("\0")
+                for start in range(0, shape[0] * width, width)]
+    if descr not in TYPECODES:
+        raise ValueError(f"unsupported dtype {descr}")
+    values = array(TYPECODES[descr])
+    values.frombytes(data[:shape[0] * values.itemsize])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tolist()
+
+class NpyAppender:
+    """Write a .npy file chunk by chunk, without holding the whole array.
+
+    The header reserves HEADER_SIZE bytes and is rewritten with the length
+    after every chunk, so the file is complete up to the last chunk even
+    if the writer never gets to close it. With width, the array is 2-d and
+    each row holds width values.
+    """
+
+    def __init__(self, path, descr, width=None):
+        self.descr = descr
+        self.width = width
+        self.length = 0
+        self.handle = open(path, "wb")  # pylint: disable=consider-using-with
+        self.write_header()
+
+    def write_header(self):
+        """Write the header for the rows appended so far."""
+        shape = (self.length,) if self.width is None else (self.length, self.width)
+        self.handle.seek(0)
+        self.handle.write(encode_header(self.descr, shape, HEADER_SIZE))
+        self.handle.seek(0, 2)
+
+    def append(self, values):
+        """Append values (flattened rows for a 2-d array) and update the header."""
+        self.handle.write(encode_data(values, self.descr))
+        self.length += len(values) // (self.width or 1)
+        self.write_header()
+
+    def close(self):
+        """Close the file."""
+        self.handle.close()
+
+def save_npz(path, arrays):
+    """Write {name: (descr, values)} as a compressed .npz archive."""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, (descr, values) in arrays.items():
+            archive.writestr(f"{name}.npy", encode_array(values, descr))
+
+def load_npz(path):
+    """Read a .npz archive as {name: list of values}."""
+    arrays = {}
+    with zipfile.ZipFile(path) as archive:
+        for member in archive.namelist():
+            if member.endswith(".npy"):
+                arrays[member[:-4]] = decode_array(archive.read(member))
+    return arrays
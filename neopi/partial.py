@@ -0,0 +1,123 @@
+"""Partial results for sharded scans.
+
+A scan run with --emit-partial writes, for every test, its per-file values
+and the sufficient statistics of all its values (count, mean and sum of
+squared deviations) to a .npz file, with the files on which it ran out
+of CPU budget (and so have no value). `neopi merge` combines the partials of
+many hosts offline, so alarm mode and cumulative ranking see the whole
+fleet. Merged filenames are prefixed with the label of the scan that found
+them (the host name unless --partial-label is given).
+"""
+
+import json
+import platform
+from .npyio import load_npz, save_npz, unicode_descr
+from .stats import RunningStats
+from .tests import (
+    LanguageIC, Entropy, LongestWord,
+    SignatureNasty, SignatureSuperNasty, UsesEval, Compression,
+    CompactResults
+)
+
+PARTIAL_FORMAT = 1
+TEST_CLASSES = {cls.__name__: cls for cls in (
+    LanguageIC, Entropy, LongestWord, SignatureNasty, SignatureSuperNasty, UsesEval, Compression
+)}
+
+def test_stats(test):
+    """Return the RunningStats of all of a test's values."""
+    if not isinstance(test.results, list):
+        return test.results.stats
+    stats = RunningStats()
+    for result in test.results:
+        if result["value"] is not None:
+            stats.add(result["value"])
+    return stats
+
+def file_index(filename, filenames, index_of):
+    """Return the index of filename in filenames, appending it if new."""
+    if filename not in index_of:
+        index_of[filename] = len(filenames)
+        filenames.append(filename)
+    return index_of[filename]
+
+def write_partial(path, tests, args, file_count, timed_out=None):
+    """Write the results of a scan to the partial file path.
+
+    timed_out maps the files that ran out of CPU budget to the names of
+    the tests that did; their indexes are kept under timed_out/<test>.
+    """
+    filenames = []
+    index_of = {}
+    arrays = {}
+    for test in tests:
+        name = test.__class__.__name__
+        indexes, values, positions = [], [], []
+        for result in test.results:
+            if result["value"] is None:
+                continue
+            indexes.append(file_index(result["filename"], filenames, index_of))
+            values.append(result["value"])
+            positions.append(result.get("position", -1))
+        arrays[f"index/{name}"] = ("<i8", indexes)
+        arrays[f"timed_out/{name}"] = ("<i8", [file_index(filename, filenames, index_of)
+                                               for filename, names in (timed_out or {}).items()
+                                               if name in names])
+        arrays[f"values/{name}"] = ("<f8", values)
+        arrays[f"positions/{name}"] = ("<i8", positions)
+        arrays[f"stats/{name}"] = ("<f8", list(test_stats(test).state))
+
+    meta = json.dumps({
+        "format": PARTIAL_FORMAT,
+        "label": args.partial_label or platform.node(),
+        "directory": args.directory,
+        "files": file_count,
+        "tests": [test.__class__.__name__ for test in tests],
+        "fingerprints": [test.fingerprint() for test in tests],
+        "block_mode": args.block_mode,
+        "stride": args.stride,
+    })
+    arrays["meta"] = (unicode_descr([meta]), [meta])
+    arrays["filenames"] = (unicode_descr(filenames), filenames)
+    save_npz(path, arrays)
+
+def read_partial(path):
+    """Read a partial file, returning (meta dict, arrays)."""
+    arrays = load_npz(path)
+    meta = json.loads(arrays["meta"][0])
+    if meta.get("format") != PARTIAL_FORMAT:
+        raise ValueError(f"{path} has unsupported format {meta.get('format')}")
+    return meta, arrays
+
+def merge_partials(paths):
+    """Combine partial files into tests holding every file's results.
+
+    Returns (tests, meta of the first partial, total file count). The
+    tests' statistics cover every value of every partial, so flag_alarm
+    works as if one scan had seen the whole fleet.
+    """
+    partials = [read_partial(path) for path in paths]
+    first = partials[0][0]
+    for path, (meta, _) in zip(paths, partials):
+        if (meta["fingerprints"], meta["block_mode"], meta["stride"]) != \
+                (first["fingerprints"], first["block_mode"], first["stride"]):
+            raise ValueError(f"{path} was made with different tests or options")
+
+    tests = []
+    for name in first["tests"]:
+        test = TEST_CLASSES[name]()
+        test.results = CompactResults(test.high_is_bad, keep_all=True)
+        stats = RunningStats()
+        for meta, arrays in partials:
+            filenames = arrays["filenames"]
+            for index, value, position in zip(arrays[f"index/{name}"], arrays[f"values/{name}"],
+                                              arrays[f"positions/{name}"]):
+                result = {"filename": f"{meta['label']}:{filenames[index]}", "value": value}
+                if position >= 0:
+                    result["position"] = position
+                test.results.append(result)
+            stats.merge(RunningStats.from_state(*arrays[f"stats/{name}"]))
+        # Partials may only hold their top results; the statistics cover all
+        test.results.stats = stats
+        tests.append(test)
+    return tests, first, sum(meta["files"] for meta, _ in partials)
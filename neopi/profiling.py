@@ -0,0 +1,85 @@
+"""Opt-in scan profiling.
+
+Workers time each test with time.process_time() and each read with the
+wall clock, and send the figures back with the file's record, so the
+totals cover every worker process. The shared AnalysisContext views (text,
+histogram) are charged to the first test that asks for them, and files
+served from the result cache are not profiled.
+"""
+
+import time
+from .tests import TopK
+
+DEFAULT_PROFILE_TOP = 5  # Slowest files listed per test
+
+class ScanProfile:
+    """Per-test CPU time, bytes and calls, plus discovery and read times."""
+
+    def __init__(self, test_names, top=DEFAULT_PROFILE_TOP):
+        self.tests = {name: {"cpu_seconds": 0.0, "bytes": 0, "calls": 0} for name in test_names}
+        self.slowest = {name: TopK(top) for name in test_names}
+        self.io = {"walk_seconds": 0.0, "read_seconds": 0.0, "files_read": 0, "bytes_read": 0}
+
+    def add(self, filename, sample):
+        """Add the (size, read seconds, per-test CPU seconds) sample of one file.
+
+        Tests skipped by the cascade prefilter have None for their time.
+        """
+        size, read_seconds, cpu_times = sample
+        self.io["read_seconds"] += read_seconds
+        self.io["files_read"] += 1
+        self.io["bytes_read"] += size
+        for (name, totals), seconds in zip(self.tests.items(), cpu_times):
+            if seconds is None:
+                continue
+            totals["cpu_seconds"] += seconds
+            totals["bytes"] += size
+            totals["calls"] += 1
+            self.slowest[name].push(filename, seconds)
+
+    def timed(self, iterable):
+        """Pass iterable through, adding the time spent producing it to walk_seconds."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.io["walk_seconds"] += time.perf_counter() - start
+                return
+            self.io["walk_seconds"] += time.perf_counter() - start
+            yield item
+
+    def as_dict(self):
+        """Return the profile as plain data, for a JSON dump."""
+        return {
+            "tests": self.tests,
+            "io": self.io,
+            "slowest": {
+                name: [{"filename": filename, "cpu_seconds": seconds}
+                       for filename, seconds, _ in top.ranked()]
+                for name, top in self.slowest.items()
+            },
+        }
+
+    def printer(self):
+        """Print the breakdown table and the slowest files of each test."""
+        total_cpu = sum(totals["cpu_seconds"] for totals in self.tests.values()) or 1.0
+        print("\n[[ Profile: CPU time per test, summed over workers ]]")
+        print(f" {'Test':<22} {'CPU s':>9} {'Share':>7} {'Calls':>8} {'MB':>9} {'MB/s':>9}")
+        for name, totals in self.tests.items():
+            seconds = totals["cpu_seconds"]
+            megabytes = totals["bytes"] / 1e6
+            rate = megabytes / seconds if seconds else 0.0
+            print(f" {name:<22} {seconds:>9.3f} {seconds / total_cpu:>7.1%} "
+                  f"{totals['calls']:>8} {megabytes:>9.2f} {rate:>9.2f}")
+        print(f" {'Discovery (walk)':<22} {self.io['walk_seconds']:>9.3f} s wall")
+        print(f" {'Read':<22} {self.io['read_seconds']:>9.3f} s wall, "
+              f"{self.io['files_read']} files, {self.io['bytes_read'] / 1e6:.2f} MB")
+
+        for name, top in self.slowest.items():
+            if not top:
+                continue
+            print(f"\n[[ Slowest {len(top)} files for {name} ]]")
+            for filename, seconds, _ in top.ranked():
+                print(f' {seconds:>9.4f} s   {filename}')
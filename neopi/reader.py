@@ -0,0 +1,108 @@
+"""Bounded file reading for the scan workers.
+
+Small files are read into memory. Larger ones are memory-mapped, so the
+tests (and block mode, which slices memoryviews) work on the page cache
+without copying the file into the Python heap. With a byte cap, huge files
+are skipped or reduced to their head and tail, so peak memory stays bounded
+whatever is lying around on disk.
+"""
+
+import mmap
+import os
+import time
+from .archive import ArchiveReader, is_archive
+
+MMAP_THRESHOLD = 1 << 20  # Map files of at least this many bytes
+DEFERRED = object()  # Returned by read() for files left to the worker
+OVERSIZE_POLICIES = ("headtail", "skip")
+
+class HeadTail(bytes):
+    """The head and tail of a file cut down to max_bytes, joined.
+
+    split is the length of the head and tail_offset the file offset of the
+    tail, so block mode can keep windows out of the join and report file
+    offsets.
+    """
+
+    def __new__(cls, head, tail, tail_offset):
+        return super().__new__(cls, head + tail)
+
+    def __init__(self, head, _tail, tail_offset):
+        super().__init__()
+        self.split = len(head)
+        self.tail_offset = tail_offset
+
+    def __reduce__(self):
+        return HeadTail, (self[:self.split], self[self.split:], self.tail_offset)
+
+class FileReader:
+    """Read files for analysis, honouring a size cap."""
+
+    def __init__(self, max_bytes=None, policy="headtail", latency=0.0):
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.mmap_threshold = MMAP_THRESHOLD
+        # Files of at least this many bytes are not read here (None reads all)
+        self.defer_threshold = None
+        # Artificial delay before each open, to simulate network filesystems
+        self.latency = latency
+        # ArchiveReader streaming the members of archives, with --archives
+        self.archives = None
+
+    @classmethod
+    def from_args(cls, args):
+        """Build a FileReader from the command line options."""
+        reader = cls(args.max_bytes, args.oversize, args.io_latency)
+        if args.archives:
+            reader.archives = ArchiveReader.from_args(args)
+        return reader
+
+    def is_archive(self, filepath):
+        """Whether filepath is an archive whose members are scanned instead."""
+        return self.archives is not None and is_archive(filepath)
+
+    def read(self, filepath):
+        """Return the data of filepath to analyse, or None.
+
+        The data is bytes, or an mmap for files of mmap_threshold bytes or
+        more (None never maps); hand it to release() when done. Files
+        larger than max_bytes are skipped or cut down to their first and
+        last max_bytes / 2 bytes, according to policy. Files of
+        defer_threshold bytes or more are not read: DEFERRED is returned.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            with open(filepath, 'rb') as file_handle:
+                size = os.fstat(file_handle.fileno()).st_size
+                if self.defer_threshold is not None and size >= self.defer_threshold:
+                    return DEFERRED
+                if self.max_bytes is not None and size > self.max_bytes:
+                    if self.policy == "skip":
+                        print(f"Skipping large file :: {filepath}")
+                        return None
+                    return self.head_tail(file_handle, size)
+                if self.mmap_threshold is not None and size >= self.mmap_threshold:
+                    return mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+                return file_handle.read()
+        except (OSError, ValueError):
+            print(f"Could not read file :: {filepath}")
+            return None
+
+    def head_tail(self, file_handle, size):
+        """Read the first and last max_bytes / 2 bytes of a file as a HeadTail."""
+        head_size = self.max_bytes // 2
+        head = file_handle.read(head_size)
+        tail_offset = size - (self.max_bytes - head_size)
+        file_handle.seek(tail_offset)
+        return HeadTail(head, file_handle.read(), tail_offset)
+
+    @staticmethod
+    def release(data):
+        """Unmap data returned by read(), if it was mapped."""
+        if isinstance(data, mmap.mmap):
+            try:
+                data.close()
+            except BufferError:
+                # A view is still alive; the mapping goes when it does
+                pass
@@ -0,0 +1,162 @@
+"""In-process scanning API for embedding neopi, e.g. in upload gateways.
+
+A Scanner is built once, with its tests and signature rules compiled, and
+then scores one buffer at a time: no process pool, no directory walk, no
+printing and no results accumulated in the tests, so it can be shared by
+the threads of a server. Given the Baseline of a previous full scan it
+also scores each value the way alarm mode would (standard deviations,
+scaled MADs or percentile ranks against that scan).
+
+    scanner = Scanner(baseline=Baseline.from_partial("fleet.npz"))
+    score = scanner.scan_bytes(upload)
+    if score.flagged(3.0):
+        reject(upload)
+"""
+
+import argparse
+from collections import namedtuple
+from .alarm import ALARM_STATS, centre_spread, deviation, pack, packed_results, percentile_rank
+from .engine import analyse
+from .partial import read_partial
+from .stats import RunningStats
+from .tests import LanguageIC, Entropy, LongestWord, SignatureNasty, SignatureSuperNasty
+
+def default_tests(rules=None):
+    """Return the tests `neopi -a` runs, with the given signature rules."""
+    return [LanguageIC(), Entropy(), LongestWord(),
+            SignatureNasty(rules), SignatureSuperNasty(rules)]
+
+class ScanScore(namedtuple("ScanScore", ["values", "positions", "scores"])):
+    """Scores of one buffer, keyed by test class name.
+
+    values holds each test's value (None for expensive tests the
+    prefilter skipped). positions holds the offset of the most suspicious
+    block in block mode, and scores each value scored against the
+    baseline; both are None otherwise.
+    """
+    __slots__ = ()
+
+    @property
+    def combined(self):
+        """Sum of the baseline scores, or None without a baseline."""
+        if self.scores is None:
+            return None
+        return sum(score for score in self.scores.values() if score is not None)
+
+    def flagged(self, threshold):
+        """Return the names of the tests scoring above threshold."""
+        return [name for name, score in (self.scores or {}).items()
+                if score is not None and score > threshold]
+
+class Baseline:
+    """Per-test statistics of a previous full scan, to score single files against.
+
+    stat is one of alarm.ALARM_STATS. Each test is looked up by its
+    fingerprint, so a baseline is only used with the same tests, rules and
+    versions it was measured with.
+    """
+
+    def __init__(self, stat="stddev", block_mode=None, stride=None):
+        if stat not in ALARM_STATS:
+            raise ValueError(f"unknown alarm statistic: {stat}")
+        self.stat = stat
+        self.block = (block_mode, stride)
+        # Fingerprint -> (centre, spread), or the sorted values for percentile
+        self.entries = {}
+
+    @classmethod
+    def from_tests(cls, tests, stat="stddev", block_mode=None, stride=None):
+        """Build a baseline from tests that have recorded a scan."""
+        baseline = cls(stat, block_mode, stride)
+        for test in tests:
+            _, _, sample = packed_results(test.results)
+            stats = None if isinstance(test.results, list) else test.results.stats
+            baseline.add(test.fingerprint(), sample, stats)
+        return baseline
+
+    @classmethod
+    def from_partial(cls, path, stat="stddev"):
+        """Build a baseline from a partial file written with --emit-partial.
+
+        Raises ValueError for the mad and percentile statistics if the
+        partial only holds some of the values (--low-memory alarm mode
+        keeps the top ones), which would skew them.
+        """
+        meta, arrays = read_partial(path)
+        baseline = cls(stat, meta["block_mode"], meta["stride"])
+        for name, fingerprint in zip(meta["tests"], meta["fingerprints"]):
+            stats = RunningStats.from_state(*arrays[f"stats/{name}"])
+            values = arrays[f"values/{name}"]
+            if stat != "stddev" and len(values) < stats.count:
+                raise ValueError(f"{path} only holds {len(values)} of the {stats.count} "
+                                 f"{name} values, too few for --alarm-stat {stat}")
+            baseline.add(fingerprint, pack(values), stats)
+        return baseline
+
+    def add(self, fingerprint, sample, stats=None):
+        """Record the statistics of a test's values in sample.
+
+        For stddev, RunningStats given as stats are used instead, as in
+        alarm mode.
+        """
+        if self.stat == "percentile":
+            self.entries[fingerprint] = sorted(float(value) for value in sample)
+        else:
+            self.entries[fingerprint] = centre_spread(sample, self.stat, stats)
+
+    def score(self, fingerprint, value, high_is_bad=True):
+        """Return the score of a test's value against this baseline."""
+        entry = self.entries[fingerprint]
+        if self.stat == "percentile":
+            return percentile_rank(value, entry, high_is_bad)
+        return deviation(value, *entry, high_is_bad)
+
+class Scanner:
+    """Score buffers in-process with a fixed set of tests.
+
+    tests defaults to those of `neopi -a`. block_size and stride select
+    block mode, and prefilter (a cascade.Prefilter) gates the expensive
+    tests as --cascade does. Scanning never changes the scanner or its
+    tests, so one scanner can serve many threads at once.
+    """
+
+    def __init__(self, tests=None, baseline=None, block_size=None, stride=None, prefilter=None):
+        self.tests = default_tests() if tests is None else list(tests)
+        self.names = [test.__class__.__name__ for test in self.tests]
+        self.options = argparse.Namespace(unicode=False, block_mode=block_size, stride=stride)
+        self.prefilter = prefilter
+        self.baseline = baseline
+        self.keys = [test.fingerprint() for test in self.tests]
+        if baseline is not None:
+            if baseline.block != (block_size, stride):
+                raise ValueError("baseline was measured with other block mode options")
+            missing = [name for name, key in zip(self.names, self.keys)
+                       if key not in baseline.entries]
+            if missing:
+                raise ValueError(f"baseline has no statistics for {', '.join(missing)}")
+
+    def scan_bytes(self, data):
+        """Return the ScanScore of data (bytes or any buffer)."""
+        values = analyse(data, self.tests, self.options, prefilter=self.prefilter)
+        positions = None
+        if self.options.block_mode:
+            values, positions = values[0::2], dict(zip(self.names, values[1::2]))
+        scores = None
+        if self.baseline is not None:
+            scores = {
+                name: None if value is None else
+                self.baseline.score(key, value, test.high_is_bad)
+                for name, key, test, value in zip(self.names, self.keys, self.tests, values)
+            }
+        return ScanScore(dict(zip(self.names, values)), positions, scores)
+
+    def scan_many(self, items, executor=None):
+        """Yield the ScanScore of each buffer in items, in order.
+
+        With an executor (e.g. a ThreadPoolExecutor) the buffers are
+        scanned concurrently.
+        """
+        if executor is not None:
+            yield from executor.map(self.scan_bytes, items)
+        else:
+            yield from map(self.scan_bytes, items)
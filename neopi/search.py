@@ -1,56 +1,157 @@
 """File search functionality."""
 
 import os
-from functools import lru_cache
-from multiprocessing import Pool
+from fnmatch import fnmatch
+from stat import S_ISREG
 
 SMALLEST = 1  # Smallest filesize to check in bytes
 
+def relative_parts(filepath, root):
+    """Return the names of filepath below root, or just its name if outside root."""
+    relative = os.path.relpath(os.path.abspath(filepath), os.path.abspath(root))
+    parts = relative.split(os.sep)
+    if parts[0] == os.pardir:
+        return [os.path.basename(filepath)]
+    return parts
+
 class SearchFile:
     """Generator that searches a given filepath with an optional regular
     expression and returns the filepath and filename"""
 
-    def __init__(self, follow_symlinks=False):
+    def __init__(self, follow_symlinks=False, excludes=(), min_size=None, max_size=None,
+                 min_mtime=None):
         self.follow_symlinks = follow_symlinks
+        self.excludes = tuple(excludes)
+        self.min_size = min_size
+        self.max_size = max_size
+        # Only files modified at or after this time (seconds since the epoch)
+        self.min_mtime = min_mtime
 
-    def is_valid_file(self, filepath, regex):
-        """Check if file matches search criteria."""
-        return (os.path.exists(filepath) and
-                regex.search(os.path.basename(filepath)) and
-                os.path.getsize(filepath) > SMALLEST
-            )
+    @classmethod
+    def from_args(cls, args):
+        """Build a SearchFile from the command line options."""
+        return cls(args.follow_links, args.exclude or (), args.min_size, args.max_size,
+                   getattr(args, "since_mtime", None))
 
-    @lru_cache(maxsize=1024)
-    def read_file(self, filepath):
-        """Read file contents with caching."""
-        try:
-            with open(filepath, 'rb') as file_handle:
-                return file_handle.read()
-        except (OSError, IOError):
-            print(f"Could not read file :: {filepath}")
-            return None
+    def is_excluded(self, name):
+        """Check if a file or directory name matches an exclude glob."""
+        return any(fnmatch(name, glob) for glob in self.excludes)
+
+    def size_ok(self, size):
+        """Check a file size against the size limits."""
+        return (size > SMALLEST and
+                (self.min_size is None or size >= self.min_size) and
+                (self.max_size is None or size <= self.max_size))
+
+    def stat_ok(self, stat):
+        """Check a file's stat result against the size and mtime limits."""
+        return (self.size_ok(stat.st_size) and
+                (self.min_mtime is None or stat.st_mtime >= self.min_mtime))
+
+    def walk(self, directory):
+        """Yield (directory path, os.DirEntry of each file) for every directory.
+
+        Starts at directory itself. Excluded directories are not descended
+        into. When following symlinks, each directory and file is visited
+        once per (device, inode), so link loops and links to already
+        scanned trees are skipped.
+        """
+        seen = set()
+        if self.follow_symlinks:
+            try:
+                stat = os.stat(directory)
+                seen.add((stat.st_dev, stat.st_ino))
+            except OSError:
+                return
+        stack = [directory]
+        while stack:
+            path = stack.pop()
+            try:
+                with os.scandir(path) as entries:
+                    entries = list(entries)
+            except OSError:
+                continue
+            subdirs = []
+            files = []
+            for entry in entries:
+                if self.is_excluded(entry.name):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=self.follow_symlinks):
+                        if self.first_visit(entry, seen):
+                            subdirs.append(entry.path)
+                    elif entry.is_file() and self.first_visit(entry, seen):
+                        files.append(entry)
+                except OSError:
+                    continue
+            yield path, files
+            # Visit directories in the order os.walk would
+            stack.extend(reversed(subdirs))
+
+    def iter_entries(self, directory):
+        """Yield the os.DirEntry of every file under directory, as walk() finds them."""
+        for _, files in self.walk(directory):
+            yield from files
+
+    def first_visit(self, entry, seen):
+        """Record entry's (device, inode), returning False if already seen.
 
-    def process_file(self, filepath, pattern):
-        """Process a single file."""
-        if not pattern.search(os.path.basename(filepath)) or os.path.getsize(filepath) <= SMALLEST:
+        Only needed when following symlinks; otherwise every path is unique.
+        """
+        if not self.follow_symlinks:
+            return True
+        stat = entry.stat()
+        key = (stat.st_dev, stat.st_ino)
+        if key in seen:
+            return False
+        seen.add(key)
+        return True
+
+    def candidate(self, filepath, pattern, root=os.curdir):
+        """Return (filepath, stat) if the file is worth scanning, else None.
+
+        As in a walk of root, excludes are matched against the names below
+        root only; for a file outside root, against its own name.
+        """
+        if not pattern.search(os.path.basename(filepath)):
+            return None
+        if any(self.is_excluded(part) for part in relative_parts(filepath, root)):
+            return None
+        try:
+            stat = os.stat(filepath)
+        except OSError:
             return None
-        file_data = self.read_file(filepath)
-        if file_data:
-            return file_data, filepath
+        if S_ISREG(stat.st_mode) and self.stat_ok(stat):
+            return filepath, stat
         return None
 
-    def _process_file_wrapper(self, args):
-        """Wrapper function for process_file to make it pickleable"""
-        filepath, pattern = args
-        return self.process_file(filepath, pattern)
-
-    def search_file_path(self, args, pattern):
-        """Search files in path matching regex pattern."""
-        with Pool() as pool:
-            for root, _, files in os.walk(args[0], followlinks=self.follow_symlinks):
-                filepaths = [os.path.join(root, f) for f in files]
-                # Create tuples of (filepath, pattern) for each file
-                work_items = [(f, pattern) for f in filepaths]
-                for result in pool.imap_unordered(self._process_file_wrapper, work_items):
-                    if result:
-                        yield result
+    def iter_candidates(self, directory, pattern):
+        """Yield (filepath, stat) for files under directory worth scanning.
+
+        The name, exclude and size filters run here, reusing the stat data
+        os.scandir already fetched, so rejected files never reach a worker.
+        """
+        for entry in self.iter_entries(directory):
+            if not pattern.search(entry.name):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if self.stat_ok(stat):
+                yield entry.path, stat
+
+    def iter_listed(self, filepaths, pattern, root=os.curdir):
+        """Yield (filepath, stat) for the listed files worth scanning.
+
+        Paths listed twice are scanned once; missing files and directories
+        are skipped. Excludes apply below root, as in candidate().
+        """
+        seen = set()
+        for filepath in filepaths:
+            if filepath in seen:
+                continue
+            seen.add(filepath)
+            found = self.candidate(filepath, pattern, root)
+            if found is not None:
+                yield found
@@ -0,0 +1,230 @@
+"""Streaming result writers.
+
+Rows are written as files complete and flushed periodically, so memory
+stays flat however many files are scanned and an interrupted scan keeps
+what it had done. Outputs ending in .gz are gzip-compressed and outputs
+ending in .zst are zstd-compressed (requires the zstandard package).
+"""
+
+import csv
+import gzip
+import json
+import os
+import time
+
+FLUSH_INTERVAL = 5.0  # Seconds between flushes
+TIMED_OUT_COLUMN = "timed_out"  # Last column with a CPU budget: the tests that ran out
+
+def open_text(path, mode):
+    """Open path as text, compressed according to its suffix."""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8", newline="")
+    if path.endswith(".zst"):
+        try:
+            import zstandard  # pylint: disable=import-outside-toplevel
+        except ImportError as err:
+            raise ValueError("the zstandard package is required for .zst output") from err
+        return zstandard.open(path, mode, encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+def parse_value(text):
+    """Turn a CSV cell back into the number (or None) it was written from.
+
+    Cells that are not numbers, such as the names in the timed_out column,
+    are returned as they are.
+    """
+    if text == "":
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+def complete_lines(handle):
+    """Yield the lines of handle, leaving out a last line cut short before its newline.
+
+    A row written up to the middle of its last value still has every
+    column, so only rows whose terminator made it to disk count as done.
+    """
+    for line in handle:
+        if line.endswith(("\n", "\r")):
+            yield line
+
+def temp_path_for(path):
+    """Return a sibling path for path that keeps its compression suffix."""
+    root, ext = os.path.splitext(path)
+    if ext in (".gz", ".zst"):
+        return f"{root}.tmp{ext}"
+    return f"{path}.tmp"
+
+class RowSink:
+    """Base class for writers of result rows (filename followed by values)."""
+
+    def __init__(self, path, header):
+        self.path = path
+        self.header = header
+        self.handle = open_text(path, "wt")
+        self.last_flush = time.monotonic()
+        self.write_header()
+
+    def write_header(self):
+        """Write whatever precedes the rows."""
+
+    def write_row(self, row):
+        """Write a single row. Must be overridden by child classes."""
+        raise NotImplementedError("write_row must be implemented by child class")
+
+    @classmethod
+    def read_rows(cls, path, header):
+        """Yield the complete rows of an existing output. Must be overridden."""
+        raise NotImplementedError("read_rows must be implemented by child class")
+
+    def write(self, row):
+        """Write a row, flushing if enough time has passed."""
+        self.write_row(row)
+        now = time.monotonic()
+        if now - self.last_flush >= FLUSH_INTERVAL:
+            self.handle.flush()
+            self.last_flush = now
+
+    def close(self):
+        """Flush and close the output."""
+        self.handle.close()
+
+    @classmethod
+    def resume(cls, path, header, keep=None):
+        """Reopen an existing output, returning (sink, rows already written).
+
+        Only complete rows are kept (filtered by keep, a set of filenames,
+        if given). They are rewritten to a fresh file that then replaces
+        the old one, so a row cut short by a crash, or a truncated
+        compressed stream, does not corrupt the output.
+        """
+        rows = []
+        if os.path.exists(path):
+            rows = [row for row in cls.read_rows(path, header)
+                    if keep is None or row[0] in keep]
+        temp_path = temp_path_for(path)
+        sink = cls(temp_path, header)
+        for row in rows:
+            sink.write_row(row)
+        sink.handle.flush()
+        os.replace(temp_path, path)
+        sink.path = path
+        return sink, rows
+
+class CsvSink(RowSink):
+    """Write rows as CSV with a header line."""
+
+    def __init__(self, path, header):
+        self.writer = None
+        super().__init__(path, header)
+
+    def write_header(self):
+        self.writer = csv.writer(self.handle)
+        self.writer.writerow(self.header)
+
+    def write_row(self, row):
+        self.writer.writerow(row)
+
+    @classmethod
+    def read_rows(cls, path, header):
+        with open_text(path, "rt") as handle:
+            reader = csv.reader(complete_lines(handle))
+            try:
+                found = next(reader, None)
+                if found is not None and found != header:
+                    raise ValueError(f"{path} has different columns than this scan")
+                for row in reader:
+                    if len(row) == len(header):
+                        yield [row[0]] + [parse_value(cell) for cell in row[1:]]
+            except (EOFError, csv.Error, OSError):
+                return
+
+class JsonlSink(RowSink):
+    """Write one JSON object per row, keyed by column name."""
+
+    def __init__(self, path, header):
+        self.keys = self.column_keys(header)
+        super().__init__(path, header)
+
+    @staticmethod
+    def column_keys(header):
+        """Name each block mode position column after its test."""
+        keys = []
+        for column in header:
+            keys.append(f"{keys[-1]}.position" if column == "position" and keys else column)
+        return keys
+
+    def write_row(self, row):
+        self.handle.write(json.dumps(dict(zip(self.keys, row))) + "\n")
+
+    @classmethod
+    def read_rows(cls, path, header):
+        keys = cls.column_keys(header)
+        with open_text(path, "rt") as handle:
+            try:
+                for line in complete_lines(handle):
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(entry, dict) and set(entry) == set(keys):
+                        yield [entry[key] for key in keys]
+            except (EOFError, OSError):
+                return
+
+class MultiSink:
+    """Write each row to several sinks.
+
+    resumed holds the rows recovered from existing outputs by open_sinks.
+    features is a features.FeatureWriter also given each row, if any.
+    """
+
+    def __init__(self, sinks=(), resumed=(), features=None):
+        self.sinks = list(sinks)
+        self.resumed = list(resumed)
+        self.features = features
+
+    def write(self, row, histogram=None):
+        """Write row to every sink, and with its byte counts to features."""
+        for sink in self.sinks:
+            sink.write(row)
+        if self.features is not None:
+            self.features.write(row, histogram)
+
+    def close(self):
+        """Close every sink."""
+        for sink in self.sinks:
+            sink.close()
+        if self.features is not None:
+            self.features.close()
+
+def open_sinks(outputs, header, resume=False):
+    """Open a MultiSink over (sink class, path) pairs.
+
+    With resume, rows already present in every existing output are kept
+    and returned as resumed; the others are dropped so that they are
+    scanned and written again.
+    """
+    if not resume:
+        return MultiSink(cls(path, header) for cls, path in outputs)
+
+    done = None
+    for cls, path in outputs:
+        found = set()
+        if os.path.exists(path):
+            found = {row[0] for row in cls.read_rows(path, header)}
+        done = found if done is None else done & found
+
+    sinks = []
+    resumed = []
+    for cls, path in outputs:
+        sink, rows = cls.resume(path, header, done)
+        sinks.append(sink)
+        resumed = resumed or rows
+    return MultiSink(sinks, resumed)
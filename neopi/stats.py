@@ -0,0 +1,65 @@
+"""Streaming statistics over test results."""
+
+import math
+
+class RunningStats:
+    """Running mean and population variance (Welford's method).
+
+    Values can be removed again, so a result that changes can be replaced
+    without recomputing over every other result.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    @classmethod
+    def from_state(cls, count, mean, m2):
+        """Rebuild statistics saved with state."""
+        stats = cls()
+        stats.count, stats.mean, stats._m2 = int(count), mean, m2
+        return stats
+
+    @property
+    def state(self):
+        """(count, mean, sum of squared deviations), enough to merge later."""
+        return self.count, self.mean, self._m2
+
+    def add(self, value):
+        """Include value."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def remove(self, value):
+        """Exclude a value previously added."""
+        self.count -= 1
+        if self.count <= 0:
+            self.count, self.mean, self._m2 = 0, 0.0, 0.0
+            return
+        old_mean = self.mean - (value - self.mean) / self.count
+        self._m2 = max(self._m2 - (value - old_mean) * (value - self.mean), 0.0)
+        self.mean = old_mean
+
+    def merge(self, other):
+        """Include every value of other (Chan et al.'s pairwise update)."""
+        other_count, other_mean, other_m2 = other.state
+        if not other_count:
+            return
+        count = self.count + other_count
+        delta = other_mean - self.mean
+        self._m2 += other_m2 + delta * delta * self.count * other_count / count
+        self.mean += delta * other_count / count
+        self.count = count
+
+    @property
+    def variance(self):
+        """Population variance of the current values."""
+        return self._m2 / self.count if self.count else 0.0
+
+    @property
+    def stddev(self):
+        """Population standard deviation of the current values."""
+        return math.sqrt(self.variance)
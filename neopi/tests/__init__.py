@@ -8,18 +8,29 @@ This module provides various test classes for analyzing files:
 """
 
 from .base import Test
+from .context import AnalysisContext
+from .results import CompactResults, TopK, DEFAULT_TOP_K
 from .utils import decode_input
 from .entropy import Entropy
 from .language import LanguageIC
 from .compression import Compression
-from .signatures import SignatureNasty, SignatureSuperNasty, UsesEval
+from .rules import Rule, RuleSet, load_rules, default_rules
+from .signatures import SignatureTest, SignatureNasty, SignatureSuperNasty, UsesEval
 from .words import LongestWord
 
 __all__ = [
     'Test',
+    'AnalysisContext',
+    'CompactResults',
+    'TopK',
     'Entropy',
     'LanguageIC',
     'Compression',
+    'Rule',
+    'RuleSet',
+    'load_rules',
+    'default_rules',
+    'SignatureTest',
     'SignatureNasty',
     'SignatureSuperNasty',
     'UsesEval',
@@ -1,32 +1,67 @@
 """Base test class definition."""
 
-import math
+from ..alarm import flag_alarm
+from .context import AnalysisContext
+from .window import window_starts
 
 class Test:
     """Base class for all tests"""
+    # Bump when a change to measure() alters the values it returns
+    version = 1
+    # Expensive tests only run on files passing the --cascade prefilter
+    expensive = False
+
     def __init__(self):
         # high_is_bad means the higher the metric, the more suspicious it is
         self.high_is_bad = True
         self.results = []
-        self.mean = 0
-        self.stddev = 0
-    def calculate(self, input_data, filepath):
-        """Calculate metric for given data. Should be overridden by child classes."""
-        raise NotImplementedError("Calculate method must be implemented by child class")
+    def measure(self, input_data):
+        """Return metric for given data. Should be overridden by child classes.
+
+        Unlike calculate() this does not touch self.results, so it is safe to
+        call from worker processes whose results are merged by the parent.
+        """
+        raise NotImplementedError("Measure method must be implemented by child class")
+
+    def fingerprint(self):
+        """Identify this test and everything that affects its values."""
+        return f"{self.__class__.__name__}:{self.version}"
 
-    def block_calculate(self, block_size, input_data, filepath):
-        """Calculate metric for blocks of data of given size."""
+    def calculate(self, input_data, filepath):
+        """Calculate metric for given data and record it."""
+        value = self.measure(input_data)
+        self.record(filepath, value)
+        return value
+
+    def record(self, filepath, value, position=None):
+        """Append a result for filepath, as produced here or by a worker."""
+        result = {"filename": filepath, "value": value}
+        if position is not None:
+            result["position"] = position
+        self.results.append(result)
+
+    def block_measure(self, block_size, input_data, stride=None):
+        """Return the most suspicious block of given size and its offset.
+
+        Blocks advance by stride bytes (default: block_size, i.e. no overlap)
+        and are taken as memoryview slices, so no block is copied.
+        """
+        input_data = AnalysisContext.wrap(input_data).data
         if not input_data:
             return {"value": 0, "position": 0}
-        num_blocks = int(math.ceil(len(input_data) / block_size))
+        view = memoryview(input_data)
+        scores = (
+            (start, self.measure(view[start:start + block_size]))
+            for start in window_starts(len(view), block_size, stride or block_size)
+        )
+        return self.best_block(scores)
+
+    def best_block(self, scores):
+        """Pick the most suspicious of (position, value) pairs."""
         max_entropy = float('-inf')
         min_entropy = float('inf')
         pos = 0
-        for i in range(num_blocks):
-            start = i * block_size
-            block_data = input_data[start:start + block_size]
-            calc_result = self.calculate(block_data, filepath)
-
+        for start, calc_result in scores:
             if self.high_is_bad:
                 if max_entropy <= calc_result:
                     max_entropy = calc_result
@@ -34,46 +69,32 @@ class Test:
             elif min_entropy > calc_result:
                 min_entropy = calc_result
                 pos = start
-        result = {
+        return {
             "value": max_entropy if self.high_is_bad else min_entropy,
             "position": pos
         }
-        self.results.append({"filename": filepath, **result})
+
+    def block_calculate(self, block_size, input_data, filepath, stride=None):
+        """Calculate metric for blocks of data of given size and record it."""
+        result = self.block_measure(block_size, input_data, stride)
+        self.record(filepath, result["value"], result["position"])
         return result
 
-    def calc_mean(self):
-        """Calculate mean of all results."""
-        if not self.results:
-            return 0
-        return sum(r["value"] for r in self.results) / len(self.results)
+    def flag_alarm(self, deviation_thresh=1.5, stat="stddev", reference=None):
+        """Flag suspicious files based on deviation from the centre of all values.
 
-    def calc_std_dev(self):
-        """Calculate standard deviation of results."""
-        if not self.results:
-            return 0
-        self.mean = self.calc_mean()
-        square_diffs = sum((r["value"] - self.mean) ** 2 for r in self.results)
-        return math.sqrt(square_diffs / len(self.results))
-
-    def flag_alarm(self, deviation_thresh=1.5):
-        """Flag suspicious files based on deviation from mean."""
-        self.mean = self.calc_mean()
-        self.stddev = self.calc_std_dev()
-
-        flag_list = []
-        for res in self.results:
-            distance = abs(res["value"] - self.mean)
-            if distance > (deviation_thresh * self.stddev):
-                if ((self.high_is_bad and res["value"] > self.mean) or
-                        (not self.high_is_bad and res["value"] < self.mean)):
-                    percentage = distance / self.stddev if self.stddev > 0 else float('inf')
-                    res["percentage"] = percentage
-                    flag_list.append(res)
-
-        return sorted(flag_list, key=lambda x: x["percentage"])
+        stat is one of alarm.ALARM_STATS; the values are compared as one
+        packed array (see neopi.alarm). reference holds the statistics of
+        a previous scan to compare with instead of these values.
+        """
+        return flag_alarm(self, deviation_thresh, stat, reference)
 
     def sort(self):
         """Sort results by value and add ranking."""
+        if not isinstance(self.results, list):
+            self.results.rank()
+            return
+
         # Filter out results with None values
         self.results = [r for r in self.results if r["value"] is not None]
 
@@ -1,16 +1,71 @@
 """Compression test implementation."""
 import zlib
 from .base import Test
+from .context import AnalysisContext
+
+ZLIB_MODES = ("exact", "fast", "stream", "sample")
+STREAM_CHUNK = 1 << 20  # Bytes fed to the compressor at a time
+SAMPLE_CHUNK = 1 << 16  # Bytes per sampled chunk
+SAMPLE_COUNT = 8  # Chunks sampled per file
 
 class Compression(Test):
-    """Test data compressibility."""
+    """Test data compressibility.
+
+    mode selects how the compressed size is obtained:
+    exact compresses the whole data at zlib's default level, stream does
+    the same through a compressobj that only counts output bytes (same
+    values, no compressed copy), fast compresses at level 1 and sample
+    compresses SAMPLE_COUNT evenly spread chunks and extrapolates.
+    """
+    expensive = True
+
+    def __init__(self, mode="exact"):
+        super().__init__()
+        if mode not in ZLIB_MODES:
+            raise ValueError(f"unknown zlib mode: {mode}")
+        self.mode = mode
 
-    def calculate(self, input_data, filepath):
+    def fingerprint(self):
+        """Include the mode, unless it gives the exact values."""
+        if self.mode in ("exact", "stream"):
+            return super().fingerprint()
+        return f"{super().fingerprint()}:{self.mode}"
+
+    def measure(self, input_data):
         """Calculate compression ratio."""
-        if not input_data:
+        context = AnalysisContext.wrap(input_data)
+        if not context:
             return 0
 
-        compressed = zlib.compress(input_data)
-        ratio = float(len(compressed)) / float(len(input_data))
-        self.results.append({"filename": filepath, "value": ratio})
-        return ratio
+        if self.mode == "stream":
+            return self._stream_ratio(context.data)
+        if self.mode == "sample":
+            return self._sample_ratio(context.data)
+        level = 1 if self.mode == "fast" else zlib.Z_DEFAULT_COMPRESSION
+        compressed = zlib.compress(context.data, level)
+        return float(len(compressed)) / float(len(context))
+
+    @staticmethod
+    def _stream_ratio(data):
+        """Compress in chunks, keeping only the running output size."""
+        view = memoryview(data)
+        compressor = zlib.compressobj()
+        size = 0
+        for start in range(0, len(view), STREAM_CHUNK):
+            size += len(compressor.compress(view[start:start + STREAM_CHUNK]))
+        size += len(compressor.flush())
+        return float(size) / float(len(view))
+
+    @staticmethod
+    def _sample_ratio(data):
+        """Compress evenly spread chunks and extrapolate to the whole data."""
+        view = memoryview(data)
+        length = len(view)
+        if length <= SAMPLE_CHUNK * SAMPLE_COUNT:
+            return float(len(zlib.compress(view))) / float(length)
+        step = (length - SAMPLE_CHUNK) // (SAMPLE_COUNT - 1)
+        size = 0
+        for idx in range(SAMPLE_COUNT):
+            start = idx * step
+            size += len(zlib.compress(view[start:start + SAMPLE_CHUNK]))
+        return float(size) / float(SAMPLE_CHUNK * SAMPLE_COUNT)
@@ -0,0 +1,65 @@
+"""Per-file analysis context shared by all tests."""
+from functools import cached_property
+from .utils import byte_histogram
+
+class AnalysisContext:
+    """Wrap the raw bytes of one file and compute derived views lazily.
+
+    Each view (decoded text, byte histogram, high-byte count) is computed
+    at most once, no matter how many tests ask for it.
+    """
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def wrap(cls, input_data):
+        """Return input_data as a context, building one for raw bytes."""
+        if isinstance(input_data, cls):
+            return input_data
+        return cls(input_data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __bool__(self):
+        return bool(self.data)
+
+    @cached_property
+    def _decoded(self):
+        """Decode once, strictly if possible, and remember whether that worked."""
+        try:
+            return str(self.data, 'utf-8'), True
+        except UnicodeDecodeError:
+            return str(self.data, 'utf-8', 'ignore'), False
+
+    @property
+    def text(self):
+        """Data decoded as UTF-8, ignoring invalid sequences."""
+        return self._decoded[0]
+
+    @property
+    def is_utf8(self):
+        """Whether the data is valid UTF-8."""
+        return self._decoded[1]
+
+    @cached_property
+    def histogram(self):
+        """Count of each byte value, as a list of 256 ints."""
+        return byte_histogram(self.data)
+
+    @cached_property
+    def ascii_count(self):
+        """Number of bytes below 128."""
+        return sum(self.histogram[:128])
+
+    @property
+    def high_byte_count(self):
+        """Number of bytes of 128 and above."""
+        return len(self.data) - self.ascii_count
+
+    def unicode_ratio(self):
+        """Fraction of non-ASCII characters, or None if not valid UTF-8."""
+        if not self.is_utf8 or not self.text:
+            return None
+        # Every ASCII byte decodes to exactly one ASCII character
+        return float(len(self.text) - self.ascii_count) / float(len(self.text))
@@ -1,27 +1,54 @@
 """Entropy test implementation."""
 import math
-from collections import Counter
 from .base import Test
+from .context import AnalysisContext
+from .window import sliding_histograms
+
+def _xlogx(count):
+    """Return count * log2(count), with 0 for an empty bin."""
+    return count * math.log2(count) if count else 0.0
+
+def shannon_entropy(counts, length):
+    """Calculate Shannon entropy from a byte histogram."""
+    entropy = 0
+    for count in counts:
+        if count:
+            probability = float(count) / length
+            entropy -= probability * math.log2(probability)
+    return entropy
 
 class Entropy(Test):
     """Calculate entropy of input data."""
 
-    def calculate(self, input_data, filepath):
+    def measure(self, input_data):
         """Calculate Shannon entropy of data."""
-        if not input_data:
+        context = AnalysisContext.wrap(input_data)
+        if not context:
             return 0
 
-        entropy = 0
-        length = len(input_data)
+        # Calculate Shannon entropy from the shared byte histogram
+        return shannon_entropy(context.histogram, len(context))
 
-        # Count byte frequencies
-        counts = Counter(input_data)
+    def block_measure(self, block_size, input_data, stride=None):
+        """Find the highest entropy window using a rolling histogram.
 
-        # Calculate Shannon entropy
-        for count in counts.values():
-            probability = float(count) / length
-            entropy -= probability * math.log2(probability)
+        Uses H = log2(n) - sum(c * log2(c)) / n and only updates the sum for
+        the byte values entering and leaving the window.
+        """
+        input_data = AnalysisContext.wrap(input_data).data
+        if not input_data:
+            return {"value": 0, "position": 0}
+        return self.best_block(self._sliding(input_data, block_size, stride or block_size))
 
-        # Append result
-        self.results.append({"filename": filepath, "value": entropy})
-        return entropy
+    @staticmethod
+    def _sliding(data, size, stride):
+        """Yield (position, entropy) for each window."""
+        weight = 0.0
+        for start, length, counts, changed in sliding_histograms(data, size, stride):
+            if changed is None:
+                weight = sum(_xlogx(count) for count in counts)
+                yield start, shannon_entropy(counts, length)
+                continue
+            for value, old in changed.items():
+                weight += _xlogx(counts[value]) - _xlogx(old)
+            yield start, max(math.log2(length) - weight / length, 0.0)
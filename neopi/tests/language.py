@@ -1,6 +1,19 @@
 """Language test implementation."""
-from collections import Counter
 from .base import Test
+from .context import AnalysisContext
+from .window import sliding_histograms
+
+def index_of_coincidence(counts):
+    """Calculate Index of Coincidence over the ASCII bins of a histogram."""
+    length = sum(counts[:128])
+    if not length:
+        return 0
+
+    index_coincidence = 0
+    for count in counts[:128]:
+        index_coincidence += count * (count - 1)
+
+    return float(index_coincidence) / (length * (length - 1)) if length > 1 else 0
 
 class LanguageIC(Test):
     """Calculate Index of Coincidence for language detection."""
@@ -8,24 +21,38 @@ class LanguageIC(Test):
         super().__init__()
         self.high_is_bad = False
 
-    def calculate(self, input_data, filepath):
+    def measure(self, input_data):
         """Calculate Index of Coincidence."""
-        if not input_data:
+        context = AnalysisContext.wrap(input_data)
+        if not context:
             return 0
 
         # Only process ASCII range
-        filtered = bytes(x for x in input_data if x < 128)
-        if not filtered:
-            return 0
+        return index_of_coincidence(context.histogram)
 
-        length = len(filtered)
-        counts = Counter(filtered)
+    def block_measure(self, block_size, input_data, stride=None):
+        """Find the lowest IC window using a rolling histogram.
 
-        # Calculate IC
-        index_coincidence = 0
-        for count in counts.values():
-            index_coincidence += count * (count - 1)
+        Keeps the running sum of c * (c - 1) and the ASCII byte count, and
+        only updates them for the byte values entering and leaving the window.
+        """
+        input_data = AnalysisContext.wrap(input_data).data
+        if not input_data:
+            return {"value": 0, "position": 0}
+        return self.best_block(self._sliding(input_data, block_size, stride or block_size))
 
-        index_coincidence = float(index_coincidence) / (length * (length - 1)) if length > 1 else 0
-        self.results.append({"filename": filepath, "value": index_coincidence})
-        return index_coincidence
+    @staticmethod
+    def _sliding(data, size, stride):
+        """Yield (position, IC) for each window."""
+        pairs = length = 0
+        for start, _, counts, changed in sliding_histograms(data, size, stride):
+            if changed is None:
+                pairs = sum(count * (count - 1) for count in counts[:128])
+                length = sum(counts[:128])
+            else:
+                for value, old in changed.items():
+                    if value < 128:
+                        new = counts[value]
+                        pairs += new * (new - 1) - old * (old - 1)
+                        length += new - old
+            yield start, float(pairs) / (length * (length - 1)) if length > 1 else 0
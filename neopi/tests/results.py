@@ -0,0 +1,157 @@
+"""Low-memory result store for tests."""
+import heapq
+import random
+from array import array
+from itertools import islice
+from ..alarm import pack
+from ..stats import RunningStats
+
+DEFAULT_TOP_K = 1000  # Most suspicious results kept when not keeping all
+SAMPLE_SIZE = 1 << 16  # Values sampled for robust statistics when not keeping all
+_SAMPLER = random.Random(0)
+
+class TopK:
+    """Bounded heap of the k most suspicious (filename, value, position)."""
+
+    def __init__(self, k=DEFAULT_TOP_K, high_is_bad=True):
+        self.k = k
+        self.high_is_bad = high_is_bad
+        self.heap = []
+        self.seq = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, filename, value, position=-1):
+        """Offer a result, keeping it only if it is among the top k."""
+        # Ties keep the earliest result, as a stable sort does
+        key = value if self.high_is_bad else -value
+        entry = (key, -self.seq, filename, value, position)
+        self.seq += 1
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        elif self.heap and entry > self.heap[0]:
+            heapq.heapreplace(self.heap, entry)
+
+    def ranked(self):
+        """Return the kept (filename, value, position), most suspicious first."""
+        return [entry[2:] for entry in sorted(self.heap, reverse=True)]
+
+class CompactResults:
+    """Drop-in replacement for a test's list of result dicts.
+
+    Keeps running mean/variance and a bounded heap of the top_k most
+    suspicious results. With keep_all every result is also kept, in
+    parallel arrays instead of one dict per file, so ranking covers all
+    files; otherwise values holds a uniform sample of SAMPLE_SIZE values
+    for the median and percentile alarm statistics. Iterating yields the
+    same dicts the list backend holds, built on the fly.
+    """
+
+    def __init__(self, high_is_bad=True, keep_all=True, top_k=DEFAULT_TOP_K):
+        self.high_is_bad = high_is_bad
+        self.stats = RunningStats()
+        self.top = TopK(top_k, high_is_bad)
+        # Filenames are shared with the other tests' stores, not copied
+        self.names = [] if keep_all else None
+        self.values = array('d')
+        self.positions = array('q')
+        # (order, ranks) once rank() has run
+        self.ranking = None
+
+    @property
+    def keep_all(self):
+        """Whether every result is kept, not just the top ones."""
+        return self.names is not None
+
+    def append(self, result):
+        """Add a result dict as produced by Test.record."""
+        value = result["value"]
+        if value is None:
+            return
+        position = result.get("position")
+        position = -1 if position is None else position
+        self.stats.add(value)
+        if self.keep_all:
+            self.names.append(result["filename"])
+            self.values.append(value)
+            self.positions.append(position)
+        elif len(self.values) < SAMPLE_SIZE:
+            self.values.append(value)
+        else:
+            # Reservoir sampling: keep each of the values seen with equal odds
+            slot = _SAMPLER.randrange(self.stats.count)
+            if slot < SAMPLE_SIZE:
+                self.values[slot] = value
+        self.top.push(result["filename"], value, position)
+        self.ranking = None
+
+    def __len__(self):
+        return len(self.values) if self.keep_all else len(self.top)
+
+    def __iter__(self):
+        ranks = self.ranking[1] if self.ranking else None
+        if not self.keep_all:
+            for idx, (filename, value, position) in enumerate(self.top.ranked()):
+                yield self._result(filename, value, position, ranks[idx] if ranks else None)
+            return
+        order = self.ranking[0] if self.ranking else range(len(self.values))
+        for idx, item in enumerate(order):
+            yield self._result(self.names[item], self.values[item], self.positions[item],
+                               ranks[idx] if ranks else None)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError("CompactResults only supports slicing")
+        return list(islice(iter(self), index.start, index.stop, index.step))
+
+    def packed(self):
+        """Return (values, result_at, sample) as alarm.packed_results does."""
+        if self.keep_all:
+            values = pack(self.values)
+            return values, self.result_at, values
+        ranked = self.top.ranked()
+        return (pack([value for _, value, _ in ranked]),
+                lambda idx: self._result(*ranked[idx], None), pack(self.values))
+
+    def column(self):
+        """Return (filenames, values) in the order recorded, or of the top results."""
+        if self.keep_all:
+            return self.names, pack(self.values)
+        ranked = self.top.ranked()
+        return [name for name, _, _ in ranked], pack([value for _, value, _ in ranked])
+
+    def result_at(self, index):
+        """Build the result dict of the index-th result recorded."""
+        return self._result(self.names[index], self.values[index], self.positions[index], None)
+
+    @staticmethod
+    def _result(filename, value, position, rank):
+        """Build the result dict the list backend would hold."""
+        result = {"filename": filename, "value": value}
+        if position >= 0:
+            result["position"] = position
+        if rank is not None:
+            result["rank"] = rank
+        return result
+
+    def rank(self):
+        """Order results from most to least suspicious and rank them."""
+        order = None
+        if self.keep_all:
+            values = self.values
+            order = array('l', sorted(range(len(values)), key=values.__getitem__,
+                                      reverse=self.high_is_bad))
+            ordered = (values[item] for item in order)
+        else:
+            ordered = (value for _, value, _ in self.top.ranked())
+
+        ranks = array('l')
+        rank = 1
+        prev_value = None
+        for i, value in enumerate(ordered, 1):
+            if prev_value is not None and prev_value != value:
+                rank = i
+            ranks.append(rank)
+            prev_value = value
+        self.ranking = (order, ranks)
@@ -0,0 +1,95 @@
+"""Signature rules loaded from JSON or YAML files."""
+import hashlib
+import json
+import os
+import re
+from functools import lru_cache
+
+DEFAULT_RULES = os.path.join(os.path.dirname(__file__), "signatures.json")
+
+class Rule:
+    """A named regex or literal indicator with a category and weight."""
+    def __init__(self, name, category, expression, literal=False, weight=1):
+        self.name = name
+        self.category = category
+        self.weight = weight
+        self.literal = expression if literal else None
+        self.regex = None if literal else re.compile(expression)
+
+    @classmethod
+    def from_dict(cls, spec):
+        """Build a rule from a rules file entry."""
+        name = spec.get("name", "<unnamed>")
+        if ("pattern" in spec) == ("literal" in spec):
+            raise ValueError(f"Rule {name}: needs exactly one of 'pattern' or 'literal'")
+        if "category" not in spec:
+            raise ValueError(f"Rule {name}: missing 'category'")
+        literal = "literal" in spec
+        expression = spec["literal"] if literal else spec["pattern"]
+        try:
+            return cls(name, spec["category"], expression, literal, spec.get("weight", 1))
+        except re.error as err:
+            raise ValueError(f"Rule {name}: invalid pattern: {err}") from err
+
+    def count(self, text):
+        """Count non-overlapping matches in text without building a match list."""
+        if self.literal is not None:
+            return text.count(self.literal)
+        return sum(1 for _ in self.regex.finditer(text))
+
+class RuleSet:
+    """A compiled collection of rules."""
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __add__(self, other):
+        return RuleSet(self.rules + other.rules)
+
+    def categories(self):
+        """Return the set of categories used by the rules."""
+        return {rule.category for rule in self.rules}
+
+    def select(self, category):
+        """Return the rules of a single category."""
+        return RuleSet(rule for rule in self.rules if rule.category == category)
+
+    def digest(self):
+        """Return a short hash of the rules, to tell rule sets apart."""
+        spec = repr([(rule.name, rule.category, rule.literal,
+                      rule.regex.pattern if rule.regex else None, rule.weight)
+                     for rule in self.rules])
+        return hashlib.sha1(spec.encode("utf-8")).hexdigest()[:12]
+
+    def score(self, text):
+        """Return the weighted sum of all rule matches in text."""
+        return sum(rule.count(text) * rule.weight for rule in self.rules)
+
+def load_rules(path):
+    """Load a RuleSet from a JSON or YAML file.
+
+    The file holds a list of rules, or a mapping with a "rules" list. Each
+    rule has a name, a category, a weight (default 1) and either a regex
+    "pattern" or a plain "literal" string.
+    """
+    with open(path, encoding="utf-8") as rules_file:
+        if path.endswith((".yml", ".yaml")):
+            try:
+                import yaml  # pylint: disable=import-outside-toplevel
+            except ImportError as err:
+                raise ValueError("PyYAML is required to load YAML rules") from err
+            spec = yaml.safe_load(rules_file)
+        else:
+            spec = json.load(rules_file)
+    if isinstance(spec, dict):
+        spec = spec.get("rules", [])
+    if not isinstance(spec, list):
+        raise ValueError(f"{path}: expected a list of rules")
+    return RuleSet(Rule.from_dict(entry) for entry in spec)
+
+@lru_cache(maxsize=1)
+def default_rules():
+    """Return the rules shipped with neopi."""
+    return load_rules(DEFAULT_RULES)
@@ -1,72 +1,38 @@
 """Signature-based tests implementation."""
-import re
 from .base import Test
-from .utils import decode_input
-
-class SignatureNasty(Test):
-    """Test for suspicious code patterns."""
-
-    def calculate(self, input_data, filepath):
-        """Check for suspicious patterns."""
-        data = decode_input(input_data)
-        if data is None:
+from .context import AnalysisContext
+from .rules import default_rules
+
+class SignatureTest(Test):
+    """Weighted count of the signature rules in one category."""
+    category = None
+
+    def __init__(self, rules=None):
+        super().__init__()
+        if rules is None:
+            rules = default_rules()
+        self.rules = rules.select(self.category)
+
+    def fingerprint(self):
+        """Include the rules in the fingerprint."""
+        return f"{super().fingerprint()}:{self.rules.digest()}"
+
+    def measure(self, input_data):
+        """Score the rules of this test's category."""
+        context = AnalysisContext.wrap(input_data)
+        if not context:
             return 0
 
-        score = 0
-        patterns = [
-            r'chr\(.*?\)',
-            r'base64',
-            r'eval\(',
-            r'exec\(',
-            r'str\.replace',
-            r'\\x[0-9a-fA-F]{2}'
-        ]
-        for pattern in patterns:
-            matches = re.findall(pattern, data)
-            score += len(matches)
-        self.results.append({"filename": filepath, "value": score})
-        self.results.append({"filename": filepath, "value": score})
-        return score
+        return self.rules.score(context.text)
 
-class SignatureSuperNasty(Test):
-    """Test for highly suspicious code patterns."""
-    def calculate(self, input_data, filepath):
-        """Check for highly suspicious patterns."""
-        if not input_data:
-            return 0
-
-        try:
-            data = input_data.decode('utf-8', errors='ignore')
-        except UnicodeError:
-            return 0
+class SignatureNasty(SignatureTest):
+    """Test for suspicious code patterns."""
+    category = "nasty"
 
-        score = 0
-        patterns = [
-            r'system\(',
-            r'shell_exec',
-            r'passthru\(',
-            r'eval\(base64_decode',
-            r'assert\(',
-            r'preg_replace.*\/e'
-        ]
-        for pattern in patterns:
-            matches = re.findall(pattern, data)
-            score += len(matches) * 2
-        return score
+class SignatureSuperNasty(SignatureTest):
+    """Test for highly suspicious code patterns."""
+    category = "supernasty"
 
-class UsesEval(Test):
+class UsesEval(SignatureTest):
     """Test specifically for eval() usage."""
-    def calculate(self, input_data, filepath):
-        """Check for eval() usage."""
-        if not input_data:
-            return 0
-
-        try:
-            data = input_data.decode('utf-8', errors='ignore')
-        except UnicodeError:
-            return 0
-
-        matches = re.findall(r'eval\s*\(', data)
-        score = len(matches)
-        self.results.append({"filename": filepath, "value": score})
-        return score
+    category = "eval"
@@ -1,4 +1,13 @@
 """Utility functions for tests."""
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+HISTOGRAM_CHUNK = 1 << 20  # Bytes counted per bincount call
+
 def decode_input(input_data):
     """Safely decode input data to UTF-8 string.
     
@@ -11,3 +20,24 @@ def decode_input(input_data):
         return input_data.decode('utf-8', errors='ignore')
     except UnicodeError:
         return None
+
+def byte_histogram(data):
+    """Count occurrences of each byte value in data.
+
+    Uses numpy.bincount over a zero-copy view of the buffer when NumPy is
+    installed and falls back to a Counter otherwise. Both backends return
+    the same plain ints, so everything derived from them is identical.
+    bincount widens its input to 64-bit ints, so large (memory-mapped)
+    data is counted in chunks to keep that copy small.
+
+    Returns:
+        List of 256 ints, indexed by byte value
+    """
+    if numpy is not None:
+        view = numpy.frombuffer(data, dtype=numpy.uint8)
+        counts = numpy.zeros(256, dtype=numpy.int64)
+        for start in range(0, len(view), HISTOGRAM_CHUNK):
+            counts += numpy.bincount(view[start:start + HISTOGRAM_CHUNK], minlength=256)
+        return counts.tolist()
+    counts = Counter(memoryview(data).cast('B'))
+    return [counts.get(value, 0) for value in range(256)]
@@ -0,0 +1,46 @@
+"""Sliding window helpers for block mode."""
+from collections import Counter
+from .utils import byte_histogram
+
+def window_starts(length, size, stride):
+    """Yield the start offset of each window over length bytes.
+
+    Windows advance by stride and stop at the first one reaching the end,
+    so with stride == size this gives the classic non-overlapping blocks
+    including a final partial one.
+    """
+    start = 0
+    while True:
+        yield start
+        if start + size >= length:
+            return
+        start += stride
+
+def sliding_histograms(data, size, stride):
+    """Yield (start, length, counts, changed) for each window over data.
+
+    counts is a rolling list of 256 byte counts for the current window. It
+    is updated in place from the bytes entering and leaving the window, so
+    the whole walk is O(len(data)) however small the stride. changed maps
+    each byte value whose count moved to its previous count, or is None
+    when the histogram was rebuilt and any running sums must be reset.
+    """
+    view = memoryview(data).cast('B')
+    length = len(view)
+    counts = []
+    prev_start = prev_end = 0
+    for start in window_starts(length, size, stride):
+        end = min(start + size, length)
+        if not counts or start >= prev_end:
+            counts = byte_histogram(view[start:end])
+            changed = None
+        else:
+            changed = {}
+            for value, num in Counter(view[prev_start:start]).items():
+                changed.setdefault(value, counts[value])
+                counts[value] -= num
+            for value, num in Counter(view[prev_end:end]).items():
+                changed.setdefault(value, counts[value])
+                counts[value] += num
+        yield start, end - start, counts, changed
+        prev_start, prev_end = start, end
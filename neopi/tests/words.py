@@ -1,21 +1,50 @@
 """Word length test implementation."""
 import re
+from functools import lru_cache
 from .base import Test
-from .utils import decode_input
+from .context import AnalysisContext
+
+# Run lengths grow as the scan goes, so bound the patterns kept per worker
+@lru_cache(maxsize=256)
+def _run_of_at_least(length):
+    """Compile a pattern matching a whole run of at least length word bytes."""
+    return re.compile(rb"(?<![A-Za-z0-9_])[A-Za-z0-9_]{%d,}" % length)
+
+def longest_run(data):
+    """Return (length, offset) of the first longest run of [A-Za-z0-9_] bytes.
+
+    Works directly on the raw bytes (or any buffer) without building a list
+    of words: each search only looks for a run longer than the best so far,
+    and the lookbehind keeps it from retrying inside a run, so the whole
+    scan is linear.
+    """
+    best = offset = pos = 0
+    while True:
+        match = _run_of_at_least(best + 1).search(data, pos)
+        if match is None:
+            return best, offset
+        offset, pos = match.start(), match.end()
+        best = pos - offset
 
 class LongestWord(Test):
     """Find longest word/string in data."""
-    def calculate(self, input_data, filepath):
+    # 2: runs are counted over raw bytes, not over the decoded text
+    version = 2
+    expensive = True
+
+    def measure(self, input_data):
         """Calculate longest contiguous string of printable chars."""
-        data = decode_input(input_data)
-        if data is None:
+        context = AnalysisContext.wrap(input_data)
+        if not context:
             return 0
 
-        # Find longest string of printable chars
-        words = re.findall(r'[A-Za-z0-9_]+', data)
-        if not words:
-            return 0
+        return longest_run(context.data)[0]
 
-        longest = len(max(words, key=len)) if words else 0
-        self.results.append({"filename": filepath, "value": longest})
-        return longest
+    def block_measure(self, block_size, input_data, stride=None):
+        """Find the block with the longest word, positioned at the word itself."""
+        result = super().block_measure(block_size, input_data, stride)
+        data = AnalysisContext.wrap(input_data).data
+        if data:
+            start = result["position"]
+            result["position"] = start + longest_run(memoryview(data)[start:start + block_size])[1]
+        return result
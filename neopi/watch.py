@@ -0,0 +1,272 @@
+"""Watch mode: rescan files as they change.
+
+The watcher starts before the initial scan, so files changed while it
+runs are rescanned too. After the scan the per-test values are kept in
+memory together with running mean/stddev, and only created or modified
+files are read and analysed again. Changes come from inotify on Linux and from periodic
+polling elsewhere.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from .alarm import deviation
+from .engine import ScanEngine, SCANNED
+from .search import SearchFile
+from .stats import RunningStats
+
+SETTLE_TIME = 0.5  # Seconds to wait for more events before rescanning
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+class PollingWatcher:
+    """Detect changes by comparing stat snapshots of the tree."""
+
+    def __init__(self, directory, locator=None, interval=2.0):
+        self.directory = directory
+        self.locator = locator or SearchFile()
+        self.interval = interval
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self):
+        """Return {filepath: (size, mtime_ns, inode)} for every file."""
+        snapshot = {}
+        for entry in self.locator.iter_entries(self.directory):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        return snapshot
+
+    def wait(self):
+        """Block until the next poll and return (changed, deleted) paths."""
+        time.sleep(self.interval)
+        snapshot = self.take_snapshot()
+        changed = {path for path, key in snapshot.items() if self.snapshot.get(path) != key}
+        deleted = set(self.snapshot) - set(snapshot)
+        self.snapshot = snapshot
+        return changed, deleted
+
+    def close(self):
+        """Nothing to release."""
+
+class InotifyWatcher:
+    """Detect changes with Linux inotify, watching every directory."""
+
+    def __init__(self, directory, locator=None):
+        libc_name = ctypes.util.find_library("c")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.locator = locator or SearchFile()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directory = directory
+        self.dirs = {}
+        self.add_tree(directory)
+
+    def add_tree(self, directory):
+        """Watch directory and everything below it, returning the files found.
+
+        The tree is walked as the scan walks it, so with --follow-links a
+        symlink loop is entered only once.
+        """
+        found = set()
+        for root, files in self.locator.walk(directory):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {root}")
+            self.dirs[wd] = root
+            found.update(entry.path for entry in files)
+        return found
+
+    def read_events(self):
+        """Return the (wd, mask, name) events currently queued."""
+        try:
+            buffer = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def wait(self):
+        """Block until files change and return (changed, deleted) paths.
+
+        deleted may hold directories, standing for every file below them,
+        and is None after an event queue overflow, when it is unknown.
+        """
+        changed, deleted = set(), set()
+        select.select([self.fd], [], [])
+        # Let bursts of events (unpacking, deploys) settle into one batch
+        while True:
+            events = self.read_events()
+            if not events:
+                if select.select([self.fd], [], [], SETTLE_TIME)[0]:
+                    continue
+                break
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost: rescan everything
+                    return self.add_tree(self.directory), None
+                if wd not in self.dirs:
+                    continue
+                path = os.path.join(self.dirs[wd], name)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed |= self.add_tree(path) if mask & IN_ISDIR else {path}
+                    deleted.discard(path)
+                elif mask & IN_CLOSE_WRITE:
+                    changed.add(path)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    deleted.add(path)
+                    changed.discard(path)
+        return changed, deleted
+
+    def close(self):
+        """Release the inotify descriptor."""
+        os.close(self.fd)
+
+def within(filepath, paths):
+    """Return whether filepath is one of paths or lies below one of them."""
+    while filepath not in paths:
+        parent = os.path.dirname(filepath)
+        if parent == filepath:
+            return False
+        filepath = parent
+    return True
+
+def make_watcher(directory, locator=None, interval=2.0):
+    """Return an inotify watcher, or a polling one where inotify is unavailable."""
+    try:
+        return InotifyWatcher(directory, locator)
+    except (OSError, AttributeError, TypeError):
+        return PollingWatcher(directory, locator, interval)
+
+class LiveResults:
+    """Current value of one test for every file, with running statistics."""
+
+    def __init__(self, test):
+        self.test = test
+        self.values = {}
+        self.stats = RunningStats()
+        for result in test.results:
+            self.update(result["filename"], result["value"])
+
+    def update(self, filename, value):
+        """Set the value for filename, replacing any previous one."""
+        self.discard(filename)
+        if value is not None:
+            self.values[filename] = value
+            self.stats.add(value)
+
+    def discard(self, filename):
+        """Forget filename."""
+        if filename in self.values:
+            self.stats.remove(self.values.pop(filename))
+
+    def deviation(self, filename, deviation_thresh):
+        """Return the alarm deviation of filename, or None if not flagged.
+
+        Scored as by alarm.flag_alarm with the stddev statistic.
+        """
+        score = deviation(self.values[filename], self.stats.mean, self.stats.stddev,
+                          self.test.high_is_bad)
+        return score if score > deviation_thresh else None
+
+class WatchSession:
+    """Keep results current by rescanning files reported by a watcher."""
+
+    def __init__(self, tests, pattern, args):
+        self.pattern = pattern
+        self.args = args
+        self.live = [LiveResults(test) for test in tests]
+        # Changed files are few, so analyse them in this process
+        self.engine = ScanEngine(tests, pattern, argparse.Namespace(**{**vars(args), "jobs": 1}))
+        self.locator = SearchFile.from_args(args)
+        self.width = 2 if args.block_mode else 1
+
+    def known_files(self):
+        """Return every file that currently has results."""
+        return set().union(*(live.values for live in self.live))
+
+    def forget(self, filepath):
+        """Drop the results of filepath."""
+        for live in self.live:
+            live.discard(filepath)
+
+    def rescan(self, changed, deleted):
+        """Update the results for a batch of changes and report on them."""
+        if deleted is None or deleted:
+            known = self.known_files()
+            if deleted is None:
+                deleted = {path for path in known if not os.path.exists(path)}
+            for filepath in known:
+                if within(filepath, deleted):
+                    self.forget(filepath)
+
+        work = []
+        for path in sorted(changed):
+            candidate = self.locator.candidate(path, self.pattern, self.args.directory)
+            if candidate is None:
+                self.forget(path)
+            else:
+                work.append((path, None, False))
+        for record in self.engine.dispatch(work):
+            if record is None:
+                continue
+            for idx, live in enumerate(self.live):
+                value = record.values[idx * self.width] if record.status == SCANNED else None
+                live.update(record.filename, value)
+            self.report(record.filename)
+
+    def report(self, filename):
+        """Print a rescanned file's values, or only its alarms in alarm mode."""
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        for live in self.live:
+            if filename not in live.values:
+                continue
+            name = live.test.__class__.__name__
+            value = live.values[filename]
+            if not self.args.alarm_mode:
+                print(f"[{stamp}] {name:<20} {value:>10.4f}   {filename}")
+                continue
+            percentage = live.deviation(filename, self.args.alarm_mode)
+            if percentage is not None:
+                print(f"[{stamp}] FLAGGED {name:<20} {value:>10.4f} "
+                      f"({percentage:.2f} sd)   {filename}", flush=True)
+
+    def run(self, watcher):
+        """Rescan the changes reported by watcher until interrupted, then close it."""
+        kind = "inotify" if isinstance(watcher, InotifyWatcher) else "polling"
+        print(f"\n[[ Watching {watcher.directory} for changes ({kind}), Ctrl-C to stop ]]",
+              flush=True)
+        try:
+            while True:
+                changed, deleted = watcher.wait()
+                if changed or deleted:
+                    self.rescan(changed, deleted)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()